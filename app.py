@@ -1,18 +1,19 @@
 # app.py
 import time
-import sqlite3
 import streamlit as st
 import pandas as pd
-from datetime import datetime
-from db_utils import DB_NAME, load_data, create_tables, migrate_schema, export_filtered_data, database_maintenance, get_db_connection, get_activity_logs
+from datetime import datetime, timedelta
+from db_utils import RequestContext, run_migrations, export_filtered_data, database_maintenance, read_connection, get_activity_logs, get_cache_stats, to_epoch_ms
 from logic import (
     add_new_client, add_vin_to_client, add_part_to_vin,
-    add_part_without_vin, delete_client, delete_vin,
-    delete_part, update_client_and_vins, update_part,
-    add_supplier_to_part, safe_add_part_to_vin, get_suppliers_for_part
+    add_parts_bulk, delete_client, delete_vin,
+    delete_part, update_client, update_part,
+    add_supplier_to_part, get_suppliers_for_part, get_parts_inventory_page,
+    get_clients_page, search_db, find_client_id,
+    get_client_bundle
 )
 from security import validate_phone, validate_vin, validate_numeric
-from data_utils import safe_get_value, safe_get_first_row
+from data_utils import safe_get_value, safe_get_first_row, GroupIndex
 from fpdf import FPDF
 import random
 import base64
@@ -20,7 +21,7 @@ import io
 import zipfile
 import json
 import os
-from auth import init_session_state, login_form, logout, require_login, require_admin
+from auth import init_session_state, login_form, logout, require_login, require_admin, flush_activity_log
 
 # Initialize session state
 init_session_state()
@@ -34,6 +35,8 @@ if 'client_added' not in st.session_state:
     st.session_state.client_added = False
 if 'vin_added' not in st.session_state:
     st.session_state.vin_added = False
+if 'current_client_id' not in st.session_state:
+    st.session_state.current_client_id = None
 if 'current_client_phone' not in st.session_state:
     st.session_state.current_client_phone = None
 if 'current_client_name' not in st.session_state:
@@ -80,6 +83,8 @@ if 'part_conditions' not in st.session_state:
     st.session_state.part_conditions = {}
 if 'clients_page' not in st.session_state:
     st.session_state.clients_page = 0
+if 'clients_cursor' not in st.session_state:
+    st.session_state.clients_cursor = None
 if 'parts_page' not in st.session_state:
     st.session_state.parts_page = 0
 if 'action_history' not in st.session_state:
@@ -119,9 +124,8 @@ COMPANY_INFO = {
     "website": "bmwpartstt.com"
 }
 
-# --- Ensure tables are created when the app first runs ---
-create_tables()
-migrate_schema()
+# --- Bring the schema up to date (once per server process) ---
+run_migrations()
 
 # Check if user is authenticated
 if not st.session_state.authenticated:
@@ -155,7 +159,31 @@ st.session_state.last_activity = datetime.now()
 
 # Main application content
 st.title("Brent J. Marketing, car parts database")
-df_clients, df_vins, df_parts, df_part_suppliers = load_data()
+
+# Data each view needs up front: cached tables it reads in full, and the
+# session state keys holding the client id, VIN or part id whose rows it
+# reads. Anything else a view touches is loaded lazily the first time it is used.
+VIEW_DATA = {
+    'client_details': {'client': 'current_client_id'},
+    'generate_pdf_flow': {'tables': ['clients']},
+    'generate_text_quote_flow': {'tables': ['clients']},
+    'edit_part': {'part': 'part_to_edit_id'},
+    'vin_details': {'vin': 'current_vin_no_view'},
+    'add_part_to_existing_vin': {'vin': 'selected_vin_to_add_part'},
+    'add_part_without_vin_flow': {'part': 'current_part_id_to_add_supplier'},
+    'add_part_for_client': {'client': 'current_client_id'},
+    'add_part_without_vin_for_client': {'client': 'current_client_id'},
+}
+
+# Data for this script run, shared by every view below
+view_data = VIEW_DATA.get(st.session_state.view, {})
+ctx = RequestContext(
+    tables=view_data.get('tables', ()),
+    client_ids=[st.session_state.get(view_data['client'])] if 'client' in view_data else (),
+    client_loader=get_client_bundle,
+    vin_numbers=[st.session_state.get(view_data['vin'])] if 'vin' in view_data else (),
+    part_ids=[st.session_state.get(view_data['part'])] if 'part' in view_data else ()
+)
 
 # --- AUTO-BACKUP ON DEPLOYMENT ---
 if 'backup_created' not in st.session_state:
@@ -205,14 +233,28 @@ if st.session_state.view == 'activity_logs':
     st.divider()
     
     # Filter options
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     with col1:
         filter_username = st.text_input("Filter by username", "")
     with col2:
+        filter_action = st.text_input("Filter by action", "")
+    with col3:
         log_limit = st.number_input("Number of logs", min_value=10, max_value=1000, value=100)
     
-    # Load activity logs
-    logs_df = get_activity_logs(filter_username if filter_username else None, log_limit)
+    start_ms = end_ms = None
+    if st.checkbox("Filter by date range"):
+        col_start, col_end = st.columns(2)
+        with col_start:
+            start_date = st.date_input("From", datetime.now().date() - timedelta(days=7))
+        with col_end:
+            end_date = st.date_input("To", datetime.now().date())
+        # Both days are included, so the range ends at midnight after end_date
+        start_ms = to_epoch_ms(start_date)
+        end_ms = to_epoch_ms(end_date + timedelta(days=1))
+    
+    # Load activity logs, including entries still waiting in the log writer
+    flush_activity_log()
+    logs_df = get_activity_logs(filter_username or None, log_limit, filter_action or None, start_ms, end_ms)
     
     if not logs_df.empty:
         st.dataframe(logs_df, use_container_width=True)
@@ -228,6 +270,9 @@ if st.session_state.view == 'activity_logs':
             )
     else:
         st.info("No activity logs found.")
+    
+    with st.expander("Cache Statistics"):
+        st.dataframe(get_cache_stats(), use_container_width=True, hide_index=True)
 
 def set_view(view_name):
     st.session_state.view = view_name
@@ -387,6 +432,7 @@ def reset_view_and_state():
     st.session_state.show_client_form = False
     st.session_state.client_added = False
     st.session_state.vin_added = False
+    st.session_state.current_client_id = None
     st.session_state.current_client_phone = None
     st.session_state.current_client_name = None
     st.session_state.current_vin_no = None
@@ -410,6 +456,7 @@ def reset_view_and_state():
     st.session_state.show_pdf_preview = False
     st.session_state.part_conditions = {}
     st.session_state.clients_page = 0
+    st.session_state.clients_cursor = None
     st.session_state.parts_page = 0
     st.session_state.selected_items = {
         'clients': [],
@@ -448,32 +495,29 @@ def main_navigation():
     st.sidebar.markdown("---")
     st.sidebar.info(f"Logged in as: User")
 
+# Rows per table counted by the sidebar search and listed on the results page
+SEARCH_PREVIEW_LIMIT = 50
+SEARCH_RESULTS_LIMIT = 200
+
 def global_search():
     st.sidebar.markdown("---")
     st.sidebar.subheader("Global Search")
     search_term = st.sidebar.text_input("Search across all data")
     
     if search_term:
-        # Search across clients, vins, and parts
-        client_results = df_clients[df_clients['client_name'].str.contains(search_term, case=False) | 
-                                   df_clients['phone'].str.contains(search_term, case=False)]
-        
-        vin_results = df_vins[df_vins['vin_number'].str.contains(search_term, case=False) | 
-                             df_vins['model'].str.contains(search_term, case=False)]
-        
-        part_results = df_parts[df_parts['part_name'].str.contains(search_term, case=False) | 
-                               df_parts['part_number'].str.contains(search_term, case=False)]
+        # Search across clients, vins, and parts through the full-text index
+        results = search_db(search_term, limit=SEARCH_PREVIEW_LIMIT)
+        counts = {
+            table: f"{len(rows)}+" if len(rows) >= SEARCH_PREVIEW_LIMIT else str(len(rows))
+            for table, rows in results.items()
+        }
         
-        if not client_results.empty or not vin_results.empty or not part_results.empty:
-            st.sidebar.success(f"Found {len(client_results)} clients, {len(vin_results)} VINs, {len(part_results)} parts")
+        if any(not rows.empty for rows in results.values()):
+            st.sidebar.success(f"Found {counts['clients']} clients, {counts['vins']} VINs, {counts['parts']} parts")
             
             if st.sidebar.button("View Search Results"):
                 st.session_state.view = 'search_results'
-                st.session_state.search_results = {
-                    'clients': client_results,
-                    'vins': vin_results,
-                    'parts': part_results
-                }
+                st.session_state.search_term = search_term
                 st.session_state.need_rerun = True
 
 def export_data():
@@ -574,7 +618,7 @@ def database_maintenance_interface():
             st.sidebar.error("Database optimization failed")
     
     if st.sidebar.button("Check Database Integrity"):
-        with sqlite3.connect(DB_NAME) as conn:
+        with read_connection() as conn:
             result = conn.execute("PRAGMA integrity_check").fetchone()
         if result[0] == "ok":
             st.sidebar.success("Database integrity: OK")
@@ -585,14 +629,11 @@ def database_maintenance_interface():
 
 def get_supplier_info(part_id, supplier_idx):
     """Get supplier information by index"""
-    conn = get_db_connection()
-    if conn is None:
-        return None
-    
-    suppliers = pd.read_sql_query(
-        "SELECT * FROM part_suppliers WHERE part_id = ? ORDER BY supplier_name",
-        conn, params=[part_id]
-    )
+    with read_connection() as conn:
+        suppliers = pd.read_sql_query(
+            "SELECT * FROM part_suppliers WHERE part_id = ? ORDER BY supplier_name",
+            conn, params=[part_id]
+        )
     
     if not suppliers.empty and supplier_idx < len(suppliers):
         return suppliers.iloc[supplier_idx]
@@ -600,8 +641,6 @@ def get_supplier_info(part_id, supplier_idx):
 
 # --- UI LOGIC ---
 
-df_clients, df_vins, df_parts, df_part_suppliers = load_data()
-
 # Add navigation sidebar
 main_navigation()
 global_search()
@@ -631,11 +670,14 @@ if st.session_state.view == 'main':
 
     if search_term:
         with st.spinner("Searching for client..."):
-            found_client = df_clients[df_clients['phone'].astype(str) == search_term]
-            if not found_client.empty:
+            # Phones match in any format through the normalized key
+            found_id = find_client_id(search_term)
+            found_client = ctx.for_client(found_id).get_client_by_id(found_id) if found_id is not None else None
+            if found_client is not None:
                 st.session_state.view = 'client_details'
-                st.session_state.current_client_phone = found_client['phone'].iloc[0]
-                st.session_state.current_client_name = found_client['client_name'].iloc[0]
+                st.session_state.current_client_id = int(found_client['id'])
+                st.session_state.current_client_phone = found_client['phone']
+                st.session_state.current_client_name = found_client['client_name']
                 st.session_state.need_rerun = True
             else:
                 st.warning("No client found with that exact phone number.")
@@ -680,29 +722,25 @@ elif st.session_state.view == 'generate_pdf_flow':
     
     st.divider()
 
-    df_clients, df_vins, df_parts, df_part_suppliers = load_data()
-
     # Step 1: Select a Client
-    client_options = [''] + sorted(df_clients['phone'].dropna().unique().tolist())
+    client_options = [''] + ctx.index.client_phones()
     st.session_state.quote_selected_phone = st.selectbox("Select Client Phone Number:", options=client_options, key="pdf_phone_selector")
 
     if st.session_state.quote_selected_phone:
-        selected_client_name = df_clients[df_clients['phone'].astype(str) == st.session_state.quote_selected_phone]['client_name'].iloc[0]
+        selected_client_id = int(ctx.index.get_client(st.session_state.quote_selected_phone)['id'])
+        client_data = ctx.for_client(selected_client_id)
+        selected_client_name = client_data.get_client_by_id(selected_client_id)['client_name']
         st.subheader(f"Parts for Client: `{selected_client_name}`")
 
         # Step 2: Allow VIN selection for that client
-        vins_for_client = df_vins[df_vins['client_phone'].astype(str) == st.session_state.quote_selected_phone]['vin_number'].tolist()
+        vins_for_client = client_data.vins_for_client(selected_client_id)['vin_number'].tolist()
         vin_options = ['Show All Parts'] + sorted(vins_for_client)
         st.session_state.quote_selected_vin = st.selectbox("Filter by VIN (optional):", options=vin_options, key="pdf_vin_selector")
 
         # Step 3: Get parts based on selections
-        if st.session_state.quote_selected_vin == 'Show All Parts':
-            parts_to_display = df_parts[df_parts['client_phone'].astype(str) == st.session_state.quote_selected_phone]
-        else:
-            parts_to_display = df_parts[
-                (df_parts['client_phone'].astype(str) == st.session_state.quote_selected_phone) &
-                (df_parts['vin_number'] == st.session_state.quote_selected_vin)
-            ]
+        parts_to_display = client_data.parts_for_client(selected_client_id)
+        if st.session_state.quote_selected_vin != 'Show All Parts':
+            parts_to_display = parts_to_display[parts_to_display['vin_number'] == st.session_state.quote_selected_vin]
         
         if not parts_to_display.empty:
             
@@ -714,7 +752,7 @@ elif st.session_state.view == 'generate_pdf_flow':
             
             for _, part_row in parts_to_display.iterrows():
                 # Get all suppliers for this part
-                part_suppliers = df_part_suppliers[df_part_suppliers['part_id'] == part_row['id']]
+                part_suppliers = client_data.suppliers_for_part(part_row['id'])
                 
                 if not part_suppliers.empty:
                     # Create expander for each part
@@ -864,7 +902,7 @@ elif st.session_state.view == 'generate_pdf_flow':
                     total_quote_amount = 0
                     
                     for part_id, supplier_data in selected_parts_data.items():
-                        part_row = df_parts[df_parts['id'] == part_id].iloc[0]
+                        part_row = client_data.get_part(part_id)
                         
                         # Use the stored price instead of querying again
                         selling_price = supplier_data['price']
@@ -925,29 +963,25 @@ elif st.session_state.view == 'generate_text_quote_flow':
     
     st.divider()
 
-    df_clients, df_vins, df_parts, df_part_suppliers = load_data()
-
     # Step 1: Select a Client
-    client_options = [''] + sorted(df_clients['phone'].dropna().unique().tolist())
+    client_options = [''] + ctx.index.client_phones()
     st.session_state.quote_selected_phone = st.selectbox("Select Client Phone Number:", options=client_options, key="quote_text_phone_selector")
 
     if st.session_state.quote_selected_phone:
-        selected_client_name = df_clients[df_clients['phone'].astype(str) == st.session_state.quote_selected_phone]['client_name'].iloc[0]
+        selected_client_id = int(ctx.index.get_client(st.session_state.quote_selected_phone)['id'])
+        client_data = ctx.for_client(selected_client_id)
+        selected_client_name = client_data.get_client_by_id(selected_client_id)['client_name']
         st.subheader(f"Parts for Client: `{selected_client_name}`")
 
         # Step 2: Allow VIN selection for that client
-        vins_for_client = df_vins[df_vins['client_phone'].astype(str) == st.session_state.quote_selected_phone]['vin_number'].tolist()
+        vins_for_client = client_data.vins_for_client(selected_client_id)['vin_number'].tolist()
         vin_options = ['Show All Parts'] + sorted(vins_for_client)
         st.session_state.quote_selected_vin = st.selectbox("Filter by VIN (optional):", options=vin_options, key="quote_text_vin_selector")
 
         # Step 3: Get parts based on selections
-        if st.session_state.quote_selected_vin == 'Show All Parts':
-            parts_to_display = df_parts[df_parts['client_phone'].astype(str) == st.session_state.quote_selected_phone]
-        else:
-            parts_to_display = df_parts[
-                (df_parts['client_phone'].astype(str) == st.session_state.quote_selected_phone) &
-                (df_parts['vin_number'] == st.session_state.quote_selected_vin)
-            ]
+        parts_to_display = client_data.parts_for_client(selected_client_id)
+        if st.session_state.quote_selected_vin != 'Show All Parts':
+            parts_to_display = parts_to_display[parts_to_display['vin_number'] == st.session_state.quote_selected_vin]
         
         if not parts_to_display.empty:
             
@@ -958,7 +992,7 @@ elif st.session_state.view == 'generate_text_quote_flow':
             
             for _, part_row in parts_to_display.iterrows():
                 # Get all suppliers for this part
-                part_suppliers = df_part_suppliers[df_part_suppliers['part_id'] == part_row['id']]
+                part_suppliers = client_data.suppliers_for_part(part_row['id'])
                 
                 if not part_suppliers.empty:
                     # Create expander for each part
@@ -1060,7 +1094,7 @@ elif st.session_state.view == 'generate_text_quote_flow':
                 
                 with st.container():
                     for part_id in selected_parts_data.keys():
-                        part_row = df_parts[df_parts['id'] == part_id].iloc[0]
+                        part_row = client_data.get_part(part_id)
                         condition = st.selectbox(
                             f"Condition for {part_row['part_name']}",
                             ["New", "Used", "Refurbished"],
@@ -1098,7 +1132,7 @@ elif st.session_state.view == 'generate_text_quote_flow':
                     total_amount = 0
                     
                     for part_id, supplier_data in selected_parts_data.items():
-                        part_row = df_parts[df_parts['id'] == part_id].iloc[0]
+                        part_row = client_data.get_part(part_id)
                         
                         # Use the stored price instead of querying again
                         selling_price = supplier_data['price']
@@ -1160,52 +1194,34 @@ elif st.session_state.view == 'view_parts_inventory':
     # Search box
     search_query = st.text_input("Quick Search (name, number, or notes)")
     
-    # Apply filters
-    filtered_parts = df_parts.copy()
-    
-    # Text filters
-    if search_query:
-        filtered_parts = filtered_parts[
-            filtered_parts['part_name'].str.contains(search_query, case=False, na=False) |
-            filtered_parts['part_number'].str.contains(search_query, case=False, na=False) |
-            filtered_parts['notes'].str.contains(search_query, case=False, na=False)
-        ]
-    
-    if filter_name:
-        filtered_parts = filtered_parts[filtered_parts['part_name'].str.contains(filter_name, case=False, na=False)]
-    
-    if filter_number:
-        filtered_parts = filtered_parts[filtered_parts['part_number'].str.contains(filter_number, case=False, na=False)]
-    
-    if filter_client_phone:
-        filtered_parts = filtered_parts[filtered_parts['client_phone'] == filter_client_phone]
+    # Filtering and paging run in the database, so only one page is loaded
+    filters = {
+        'search': search_query,
+        'part_name': filter_name,
+        'part_number': filter_number,
+        'client_phone': filter_client_phone,
+        'quantity_min': filter_quantity_min,
+        'quantity_max': filter_quantity_max,
+        'has_vin': filter_has_vin,
+    }
     
-    # Quantity range filter
-    filtered_parts = filtered_parts[
-        (filtered_parts['quantity'] >= filter_quantity_min) & 
-        (filtered_parts['quantity'] <= filter_quantity_max)
-    ]
+    # Parts pagination
+    if 'parts_page' not in st.session_state:
+        st.session_state.parts_page = 0
     
-    # VIN filter
-    if filter_has_vin == "With VIN":
-        filtered_parts = filtered_parts[filtered_parts['vin_number'].notna()]
-    elif filter_has_vin == "Without VIN":
-        filtered_parts = filtered_parts[filtered_parts['vin_number'].isna()]
+    PARTS_PER_PAGE = 15
+    current_page = st.session_state.parts_page
+    current_parts, page_suppliers, total_parts = get_parts_inventory_page(filters, current_page, PARTS_PER_PAGE)
+    if total_parts and current_parts.empty:
+        # Narrower filters can leave the saved page past the end
+        current_page = st.session_state.parts_page = (total_parts - 1) // PARTS_PER_PAGE
+        current_parts, page_suppliers, total_parts = get_parts_inventory_page(filters, current_page, PARTS_PER_PAGE)
     
     # Display results with pagination
-    if not filtered_parts.empty:
-        # Parts pagination
-        if 'parts_page' not in st.session_state:
-            st.session_state.parts_page = 0
-        
-        PARTS_PER_PAGE = 15
-        total_parts = len(filtered_parts)
+    if total_parts:
         total_pages = (total_parts + PARTS_PER_PAGE - 1) // PARTS_PER_PAGE
-        current_page = st.session_state.parts_page
-        
-        start_idx = current_page * PARTS_PER_PAGE
-        end_idx = min(start_idx + PARTS_PER_PAGE, total_parts)
-        current_parts = filtered_parts.iloc[start_idx:end_idx]
+        end_idx = min((current_page + 1) * PARTS_PER_PAGE, total_parts)
+        suppliers_by_part = GroupIndex(page_suppliers, 'part_id')
         
         st.write(f"**Found {total_parts} parts**")
         
@@ -1236,7 +1252,7 @@ elif st.session_state.view == 'view_parts_inventory':
                 st.markdown("---")
                 st.subheader("Supplier Information")
                 
-                part_suppliers = df_part_suppliers[df_part_suppliers['part_id'] == part_row['id']]
+                part_suppliers = suppliers_by_part.get(part_row['id'])
                 
                 if not part_suppliers.empty:
                     st.dataframe(part_suppliers[['supplier_name', 'buying_price', 'selling_price', 'delivery_time']], 
@@ -1263,26 +1279,34 @@ elif st.session_state.view == 'client_list':
     # Pagination settings
     CLIENTS_PER_PAGE = 10
 
-    if not df_clients.empty:
-        # Calculate pagination
-        total_clients = len(df_clients)
-        total_pages = (total_clients + CLIENTS_PER_PAGE - 1) // CLIENTS_PER_PAGE
+    # Only the visible page is read, starting from the saved cursor
+    current_clients, next_cursor, prev_cursor = get_clients_page(st.session_state.clients_cursor, CLIENTS_PER_PAGE)
+    if current_clients.empty and st.session_state.clients_cursor:
+        # The rows around the saved cursor are gone; start again from the top
+        st.session_state.clients_cursor = None
+        st.session_state.clients_page = 0
+        current_clients, next_cursor, prev_cursor = get_clients_page(None, CLIENTS_PER_PAGE)
+    
+    if not current_clients.empty:
+        # No total is shown: counting every client on each rerun would cost a
+        # full scan, while the cursors already say whether more pages exist
         current_page = st.session_state.clients_page
         
         start_idx = current_page * CLIENTS_PER_PAGE
-        end_idx = min(start_idx + CLIENTS_PER_PAGE, total_clients)
-        current_clients = df_clients.iloc[start_idx:end_idx]
+        end_idx = start_idx + len(current_clients)
 
         # Pagination controls
         col_prev, col_info, col_next = st.columns([1, 2, 1])
         with col_prev:
-            if st.button("◀ Previous", disabled=current_page == 0):
-                st.session_state.clients_page -= 1
+            if st.button("◀ Previous", disabled=prev_cursor is None):
+                st.session_state.clients_cursor = prev_cursor
+                st.session_state.clients_page = max(0, current_page - 1)
                 st.session_state.need_rerun = True
         with col_info:
-            st.write(f"Page {current_page + 1} of {total_pages} | Showing {start_idx + 1}-{end_idx} of {total_clients} clients")
+            st.write(f"Page {current_page + 1} | Showing clients {start_idx + 1}-{end_idx}")
         with col_next:
-            if st.button("Next ▶", disabled=end_idx >= total_clients):
+            if st.button("Next ▶", disabled=next_cursor is None):
+                st.session_state.clients_cursor = next_cursor
                 st.session_state.clients_page += 1
                 st.session_state.need_rerun = True
 
@@ -1298,27 +1322,31 @@ elif st.session_state.view == 'client_list':
             with col3:
                 action_col1, action_col2 = st.columns([1, 1])
                 with action_col1:
-                    if st.button("View Details", key=f"view_details_{client_row['phone']}"):
+                    if st.button("View Details", key=f"view_details_{client_row['id']}"):
+                        get_client_bundle(client_row['id'])
                         st.session_state.view = 'client_details'
+                        st.session_state.current_client_id = int(client_row['id'])
                         st.session_state.current_client_phone = client_row['phone']
                         st.session_state.current_client_name = client_row['client_name']
                         st.session_state.need_rerun = True
                 with action_col2:
-                    delete_client_key = f"delete_client_{client_row['phone']}"
+                    delete_client_key = f"delete_client_{client_row['id']}"
                     if st.button("❌", help="Delete Client", key=delete_client_key):
-                        if st.session_state.get(f'confirm_delete_client_{client_row["phone"]}', False):
+                        if st.session_state.get(f'confirm_delete_client_{client_row["id"]}', False):
                             with st.spinner("Deleting client..."):
-                                delete_client(client_row['phone'], st.session_state.username)
+                                deleted = delete_client(int(client_row['id']), st.session_state.username)
 
-                            st.success(f"Client `{client_row['client_name']}` and all associated data deleted.")
-                            st.session_state.pop(f'confirm_delete_client_{client_row["phone"]}', None)
-                            st.cache_data.clear()
+                            if deleted:
+                                st.success(f"Client `{client_row['client_name']}` and all associated data deleted.")
+                            else:
+                                st.warning(f"Client `{client_row['client_name']}` was already deleted.")
+                            st.session_state.pop(f'confirm_delete_client_{client_row["id"]}', None)
                             st.session_state.need_rerun = True
                         else:
-                            st.session_state[f'confirm_delete_client_{client_row["phone"]}'] = True
+                            st.session_state[f'confirm_delete_client_{client_row["id"]}'] = True
                             st.warning("Are you sure? Click again to confirm.")
-                    if st.session_state.get(f'confirm_delete_client_{client_row["phone"]}', False) and st.button("Cancel", key=f'cancel_delete_client_{client_row["phone"]}'):
-                        st.session_state.pop(f'confirm_delete_client_{client_row["phone"]}', None)
+                    if st.session_state.get(f'confirm_delete_client_{client_row["id"]}', False) and st.button("Cancel", key=f'cancel_delete_client_{client_row["id"]}'):
+                        st.session_state.pop(f'confirm_delete_client_{client_row["id"]}', None)
                         st.session_state.need_rerun = True
             st.markdown("---")
     else:
@@ -1353,16 +1381,14 @@ elif st.session_state.view == 'client_details':
 
         st.divider()
         
-        if st.session_state.current_client_phone:
+        if st.session_state.current_client_id is not None:
+            client_data = ctx.for_client(st.session_state.current_client_id)
             st.subheader(f"Phone: {st.session_state.current_client_phone}")
             
             client_name_to_display = st.session_state.current_client_name if st.session_state.current_client_name else "No name provided"
             st.write(f"**Client Name:** {client_name_to_display}")
             
-            unassigned_parts_for_client = df_parts[
-                (df_parts['client_phone'] == st.session_state.current_client_phone) & 
-                (df_parts['vin_number'].isnull())
-            ]
+            unassigned_parts_for_client = client_data.unassigned_parts_for_client(st.session_state.current_client_id)
             
             if not unassigned_parts_for_client.empty:
                 st.write("### Unassigned Parts for this Client")
@@ -1376,8 +1402,8 @@ elif st.session_state.view == 'client_details':
                         delete_part_key = f"delete_part_unassigned_{part_row['id']}"
                         if st.button("🗑️", key=delete_part_key):
                             with st.spinner("Deleting part..."):
-                                delete_part(part_row['id'])
-                            st.cache_data.clear()
+                                if not delete_part(part_row['id'], st.session_state.username):
+                                    st.warning(f"Part `{part_row['part_name']}` was already deleted.")
                             st.session_state.need_rerun = True
                     with col_part4:
                         if st.button("✏️", key=f"edit_part_unassigned_{part_row['id']}"):
@@ -1386,7 +1412,7 @@ elif st.session_state.view == 'client_details':
                             st.session_state.need_rerun = True
 
                     # Display suppliers for this unassigned part
-                    part_suppliers = df_part_suppliers[df_part_suppliers['part_id'] == part_row['id']]
+                    part_suppliers = client_data.suppliers_for_part(part_row['id'])
                     if not part_suppliers.empty:
                         with st.expander("View Suppliers"):
                             for _, supplier_row in part_suppliers.iterrows():
@@ -1396,7 +1422,7 @@ elif st.session_state.view == 'client_details':
             else:
                 st.info("No unassigned parts for this client.")
 
-            client_vins = df_vins[df_vins['client_phone'].astype(str) == str(st.session_state.current_client_phone)]
+            client_vins = client_data.vins_for_client(st.session_state.current_client_id)
             
             if not client_vins.empty:
                 st.write("### Registered VINs")
@@ -1417,11 +1443,13 @@ elif st.session_state.view == 'client_details':
                         if st.button("❌ Delete VIN", key=delete_vin_key):
                             if st.session_state.get(f'confirm_delete_vin_{vin_row["vin_number"]}', False):
                                 with st.spinner("Deleting VIN..."):
-                                    delete_vin(vin_row['vin_number'], st.session_state.username)
+                                    deleted = delete_vin(vin_row['vin_number'], st.session_state.username)
 
-                                st.success(f"VIN `{vin_row['vin_number']}` and all associated parts deleted.")
+                                if deleted:
+                                    st.success(f"VIN `{vin_row['vin_number']}` and all associated parts deleted.")
+                                else:
+                                    st.warning(f"VIN `{vin_row['vin_number']}` was already deleted.")
                                 st.session_state.pop(f'confirm_delete_vin_{vin_row["vin_number"]}', None)
-                                st.cache_data.clear()
                                 st.session_state.need_rerun = True
                             else:
                                 st.session_state[f'confirm_delete_vin_{vin_row["vin_number"]}'] = True
@@ -1435,7 +1463,7 @@ elif st.session_state.view == 'client_details':
                             st.session_state.view = 'add_part_for_client'
                             st.session_state.need_rerun = True
 
-                    parts_for_vin = df_parts[df_parts['vin_number'] == vin_row['vin_number']]
+                    parts_for_vin = client_data.parts_for_vin(vin_row['vin_number'])
                     if not parts_for_vin.empty:
                         with st.expander(f"View Parts for VIN {vin_row['vin_number']}"):
                             for part_index, part_row in parts_for_vin.iterrows():
@@ -1448,9 +1476,9 @@ elif st.session_state.view == 'client_details':
                                     delete_part_key = f"delete_part_{part_row['id']}"
                                     if st.button("🗑️", key=delete_part_key):
                                         with st.spinner("Deleting part..."):
-                                            delete_part(part_row['id'], st.session_state.username)
+                                            if not delete_part(part_row['id'], st.session_state.username):
+                                                st.warning(f"Part `{part_row['part_name']}` was already deleted.")
 
-                                        st.cache_data.clear()
                                         st.session_state.need_rerun = True
                                 if st.button("✏️", key=f"edit_part_{part_row['id']}"):
                                     st.session_state.view = 'edit_part'
@@ -1458,7 +1486,7 @@ elif st.session_state.view == 'client_details':
                                     st.session_state.need_rerun = True
                                 
                                 # Display suppliers for this part
-                                part_suppliers = df_part_suppliers[df_part_suppliers['part_id'] == part_row['id']]
+                                part_suppliers = client_data.suppliers_for_part(part_row['id'])
                                 if not part_suppliers.empty:
                                     with st.expander("View Suppliers"):
                                         for _, supplier_row in part_suppliers.iterrows():
@@ -1481,12 +1509,12 @@ elif st.session_state.view == 'client_details':
             col1, col2, col3 = st.columns([1, 1, 1])
             with col1:
                 if st.form_submit_button("Save Changes"):
-                    old_phone = str(st.session_state.current_client_phone)
                     with st.spinner("Updating client..."):
-                        update_client_and_vins(old_phone, new_phone, new_name)
-                    st.success("✅ Client and associated VINs updated successfully!")
+                        update_client(st.session_state.current_client_id, new_phone, new_name, st.session_state.username)
+                    st.success("✅ Client updated successfully!")
+                    st.session_state.current_client_phone = new_phone
+                    st.session_state.current_client_name = new_name
                     st.session_state.edit_mode = False
-                    st.cache_data.clear()
                     st.session_state.need_rerun = True
             with col2:
                 if st.form_submit_button("Cancel"):
@@ -1502,10 +1530,11 @@ elif st.session_state.view == 'edit_part':
     st.header("Edit Part Details")
     
     part_id = st.session_state.part_to_edit_id
-    part_to_edit = df_parts[df_parts['id'] == part_id].iloc[0]
+    part_data = ctx.for_part(part_id)
+    part_to_edit = part_data.get_part(part_id)
     
     # Get existing suppliers
-    existing_suppliers = df_part_suppliers[df_part_suppliers['part_id'] == part_id]
+    existing_suppliers = part_data.suppliers_for_part(part_id)
     
     # Initialize supplier count for the form
     if 'supplier_count_edit' not in st.session_state or st.session_state.part_to_edit_id != st.session_state.get('last_edit_id'):
@@ -1532,7 +1561,7 @@ elif st.session_state.view == 'edit_part':
         part_name = st.text_input("Part Name", value=part_to_edit['part_name'])
         part_number = st.text_input("Part Number", value=part_to_edit['part_number'])
         quantity = st.number_input("Quantity", min_value=1, value=int(part_to_edit['quantity']))
-        notes = st.text_area("Notes", value=part_to_edit['notes'] or "")
+        notes = st.text_area("Notes", value=part_to_edit['notes'] if pd.notna(part_to_edit['notes']) else "")
 
         st.markdown("---")
         st.markdown("### Supplier Information")
@@ -1544,12 +1573,15 @@ elif st.session_state.view == 'edit_part':
             st.subheader(f"Supplier {i+1}")
             
             # Use existing data if available
+            supplier_id = None
             if i < len(existing_suppliers):
                 supplier_row = existing_suppliers.iloc[i]
-                supplier_name = st.text_input("Supplier Name", value=supplier_row['supplier_name'], key=f"supplier_name_edit_{i}")
-                buying_price = st.number_input("Buying Price ($)", min_value=0.0, value=supplier_row['buying_price'] or 0.0, format="%.2f", key=f"buying_price_edit_{i}")
-                selling_price = st.number_input("Selling Price ($)", min_value=0.0, value=supplier_row['selling_price'] or 0.0, format="%.2f", key=f"selling_price_edit_{i}")
-                delivery_time = st.text_input("Delivery Time", value=supplier_row['delivery_time'] or "", key=f"delivery_time_edit_{i}")
+                supplier_id = int(supplier_row['id'])
+                # Cached frames hold missing values as NaN rather than None
+                supplier_name = st.text_input("Supplier Name", value=supplier_row['supplier_name'] if pd.notna(supplier_row['supplier_name']) else "", key=f"supplier_name_edit_{i}")
+                buying_price = st.number_input("Buying Price ($)", min_value=0.0, value=float(supplier_row['buying_price']) if pd.notna(supplier_row['buying_price']) else 0.0, format="%.2f", key=f"buying_price_edit_{i}")
+                selling_price = st.number_input("Selling Price ($)", min_value=0.0, value=float(supplier_row['selling_price']) if pd.notna(supplier_row['selling_price']) else 0.0, format="%.2f", key=f"selling_price_edit_{i}")
+                delivery_time = st.text_input("Delivery Time", value=supplier_row['delivery_time'] if pd.notna(supplier_row['delivery_time']) else "", key=f"delivery_time_edit_{i}")
             else:
                 supplier_name = st.text_input("Supplier Name", key=f"supplier_name_edit_{i}")
                 buying_price = st.number_input("Buying Price ($)", min_value=0.0, value=0.0, format="%.2f", key=f"buying_price_edit_{i}")
@@ -1557,6 +1589,7 @@ elif st.session_state.view == 'edit_part':
                 delivery_time = st.text_input("Delivery Time", key=f"delivery_time_edit_{i}")
 
             suppliers_data.append({
+                "id": supplier_id,
                 "name": supplier_name,
                 "buying_price": buying_price,
                 "selling_price": selling_price,
@@ -1572,7 +1605,6 @@ elif st.session_state.view == 'edit_part':
                 st.session_state.view = 'client_details'
                 st.session_state.part_to_edit_id = None
                 st.session_state.supplier_count_edit = 1
-                st.cache_data.clear()
                 st.session_state.need_rerun = True
         with col2:
             if st.form_submit_button("Cancel"):
@@ -1591,15 +1623,16 @@ elif st.session_state.view == 'vin_details':
     
     st.divider()
 
-    selected_vin_data = df_vins[df_vins['vin_number'] == st.session_state.current_vin_no_view]
+    vin_data = ctx.for_vin(st.session_state.current_vin_no_view)
+    selected_vin_data = vin_data.get_vin(st.session_state.current_vin_no_view)
     
-    if not selected_vin_data.empty:
+    if selected_vin_data is not None:
         st.write("### Vehicle Information")
-        st.dataframe(selected_vin_data, use_container_width=True, hide_index=True)
+        st.dataframe(selected_vin_data.to_frame().T, use_container_width=True, hide_index=True)
         st.divider()
 
         st.write("### Registered Parts")
-        parts_for_vin = df_parts[df_parts['vin_number'] == st.session_state.current_vin_no_view]
+        parts_for_vin = vin_data.parts_for_vin(st.session_state.current_vin_no_view)
         
         if not parts_for_vin.empty:
             st.dataframe(parts_for_vin, use_container_width=True, hide_index=True)
@@ -1630,6 +1663,15 @@ elif st.session_state.view in ['add_part_to_existing_vin', 'add_part_without_vin
         
         current_mgmt = st.session_state.current_part_management
         
+        # Client-scoped flows only need that client's rows, and the VIN flow that VIN's;
+        # parts added without a VIN have no client, so that flow reads each part on its own
+        if st.session_state.view in ['add_part_for_client', 'add_part_without_vin_for_client']:
+            part_lookup = ctx.for_client(st.session_state.current_client_id)
+        elif st.session_state.view == 'add_part_to_existing_vin':
+            part_lookup = ctx.for_vin(st.session_state.selected_vin_to_add_part)
+        else:
+            part_lookup = None
+        
         # Tab 1: Add Parts
         with st.expander("➕ Add Parts", expanded=len(current_mgmt['saved_part_ids']) == 0):
             st.subheader("Add New Parts")
@@ -1668,52 +1710,29 @@ elif st.session_state.view in ['add_part_to_existing_vin', 'add_part_without_vin
                     if all_valid:
                         saved_ids = []
                         with st.spinner("Saving parts..."):
-                            for part in parts_data:
-                                try:
-                                    if st.session_state.view in ['add_part_to_existing_vin', 'add_part_for_client']:
-                                        # Safely get client phone from VIN
-                                        vin_match = df_vins[df_vins['vin_number'] == st.session_state.selected_vin_to_add_part]
-                                        if vin_match.empty:
-                                            st.error(f"VIN {st.session_state.selected_vin_to_add_part} not found in database")
-                                            continue
-                        
-                                        client_phone = vin_match['client_phone'].iloc[0]
-                                        part_id = safe_add_part_to_vin(
-                                            st.session_state.selected_vin_to_add_part,
-                                            client_phone,
-                                            part,
-                                            [], # No suppliers added at this stage
-                                            st.session_state.username  # ADDED USERNAME PARAMETER
-                                        )
-                                    elif st.session_state.view == 'add_part_without_vin_flow':
-                                        part_id = add_part_without_vin(
-                                            part["name"],
-                                            part["number"],
-                                            part["quantity"],
-                                            part["notes"],
-                                            client_phone=None,
-                                            suppliers=[],
-                                            username=st.session_state.username
-                                        )
-                                    elif st.session_state.view == 'add_part_without_vin_for_client':
-                                        part_id = add_part_without_vin(
-                                            part["name"],
-                                            part["number"],
-                                            part["quantity"],
-                                            part["notes"],
-                                            client_phone=st.session_state.current_client_phone,
-                                            suppliers=[],
-                                            username=st.session_state.username
-                                        )
-                    
-                                    if part_id:
-                                        saved_ids.append(part_id)
+                            try:
+                                if st.session_state.view in ['add_part_to_existing_vin', 'add_part_for_client']:
+                                    # Safely get the client from the VIN
+                                    vin_match = part_lookup.get_vin(st.session_state.selected_vin_to_add_part)
+                                    if vin_match is None:
+                                        st.error(f"VIN {st.session_state.selected_vin_to_add_part} not found in database")
                                     else:
-                                        st.error(f"Failed to save part: {part.get('name', 'Unknown')}")
-                            
-                                except Exception as e:
-                                    st.error(f"Error saving part '{part.get('name', 'Unknown')}': {str(e)}")
-                                    continue
+                                        saved_ids = add_parts_bulk(
+                                            parts_data,
+                                            st.session_state.username,
+                                            vin_number=st.session_state.selected_vin_to_add_part,
+                                            client_id=vin_match['client_id']
+                                        )
+                                elif st.session_state.view == 'add_part_without_vin_flow':
+                                    saved_ids = add_parts_bulk(parts_data, st.session_state.username)
+                                elif st.session_state.view == 'add_part_without_vin_for_client':
+                                    saved_ids = add_parts_bulk(
+                                        parts_data,
+                                        st.session_state.username,
+                                        client_id=st.session_state.current_client_id
+                                    )
+                            except Exception as e:
+                                st.error(f"Error saving parts: {str(e)}")
                         
                         if saved_ids:
                             st.session_state.current_part_management = {
@@ -1724,7 +1743,6 @@ elif st.session_state.view in ['add_part_to_existing_vin', 'add_part_without_vin
                             st.session_state.current_part_id_to_add_supplier = saved_ids[0]
                             st.success(f"✅ {len(saved_ids)} part(s) saved successfully!")
                             st.info("Please add supplier information for each part using the 'Manage Suppliers' section below.")
-                            st.cache_data.clear()
                             st.session_state.need_rerun = True
                         else:
                             st.error("No parts were saved successfully")
@@ -1759,14 +1777,14 @@ elif st.session_state.view in ['add_part_to_existing_vin', 'add_part_without_vin
             
             # Current part info
             current_part_id = current_mgmt['saved_part_ids'][current_mgmt['current_part_index']]
-            part_info = df_parts[df_parts['id'] == current_part_id]
+            part_data = part_lookup if part_lookup is not None else ctx.for_part(current_part_id)
+            part_row = part_data.get_part(current_part_id)
             
-            if not part_info.empty:
-                part_row = part_info.iloc[0]
+            if part_row is not None:
                 st.info(f"**Current Part:** {part_row['part_name']} ({part_row['part_number']}) - Qty: {part_row['quantity']}")
                 
                 # Load existing suppliers for this part
-                existing_suppliers = df_part_suppliers[df_part_suppliers['part_id'] == current_part_id]
+                existing_suppliers = part_data.suppliers_for_part(current_part_id)
                 
                 if not existing_suppliers.empty:
                     st.subheader("Current Suppliers")
@@ -1812,7 +1830,6 @@ elif st.session_state.view in ['add_part_to_existing_vin', 'add_part_without_vin
                             try:
                                 add_supplier_to_part(current_part_id, supplier_name, buying_price, selling_price, delivery_time, st.session_state.username)
                                 st.success("✅ Supplier added successfully!")
-                                st.cache_data.clear()
                                 st.session_state.need_rerun = True
                             except Exception as e:
                                 st.error(f"Error adding supplier: {str(e)}")
@@ -1927,7 +1944,7 @@ elif st.session_state.view == 'add_vin_to_existing_client':
                         clean_vin = None
                     
                     with st.spinner("Saving VIN details..."):
-                        add_vin_to_client(str(st.session_state.current_client_phone), clean_vin, model, prod_yr, body, engine, code, transmission, st.session_state.username)
+                        add_vin_to_client(st.session_state.current_client_id, clean_vin, model, prod_yr, body, engine, code, transmission, st.session_state.username)
                     st.success(f"✅ VIN details saved for {clean_vin if clean_vin else 'No VIN'}!")
                     
                     if submitted_and_add_part:
@@ -1938,7 +1955,6 @@ elif st.session_state.view == 'add_vin_to_existing_client':
                     
                     st.session_state.vin_added = False
                     st.session_state.current_vin_no = None
-                    st.cache_data.clear()
                     st.session_state.need_rerun = True
                     
                 except ValueError as e:
@@ -1966,11 +1982,11 @@ elif st.session_state.view == 'add_client':
                     else:
                         try:
                             with st.spinner("Adding new client..."):
-                                add_new_client(str(phone), client_name, st.session_state.username)
+                                client_id = add_new_client(str(phone), client_name, st.session_state.username)
                             st.session_state.client_added = True
+                            st.session_state.current_client_id = client_id
                             st.session_state.current_client_phone = str(phone)
                             st.session_state.current_client_name = client_name
-                            st.cache_data.clear()
                             st.session_state.need_rerun = True
                         except ValueError as e:
                             st.error(str(e))
@@ -2037,9 +2053,8 @@ elif st.session_state.view == 'add_client':
                         clean_vin = None
                     
                     with st.spinner("Saving VIN details..."):
-                        # FIXED: Use st.session_state.current_client_phone instead of undefined 'phone' variable
                         add_vin_to_client(
-                            str(st.session_state.current_client_phone),  # FIXED HERE
+                            st.session_state.current_client_id,
                             clean_vin,
                             model,
                             prod_yr,
@@ -2059,7 +2074,6 @@ elif st.session_state.view == 'add_client':
                     
                     st.session_state.vin_added = False
                     st.session_state.current_vin_no = None
-                    st.cache_data.clear()
                     st.session_state.need_rerun = True
                     
                 except ValueError as e:
@@ -2071,20 +2085,23 @@ elif st.session_state.view == 'search_results':
     if st.button("⬅️ Back to Main"):
         reset_view_and_state()
     
-    search_results = st.session_state.get('search_results', {})
+    search_term = st.session_state.get('search_term')
     
-    if search_results:
+    if search_term:
+        st.caption(f"Results for \"{search_term}\", best matches first")
+        search_results = search_db(search_term, limit=SEARCH_RESULTS_LIMIT)
+        
         if not search_results['clients'].empty:
             st.subheader("Clients")
-            st.dataframe(search_results['clients'][['client_name', 'phone']], use_container_width=True)
+            st.dataframe(search_results['clients'][['client_name', 'phone', 'snippet']], use_container_width=True)
         
         if not search_results['vins'].empty:
             st.subheader("VINs")
-            st.dataframe(search_results['vins'][['vin_number', 'model', 'client_phone']], use_container_width=True)
+            st.dataframe(search_results['vins'][['vin_number', 'model', 'client_phone', 'snippet']], use_container_width=True)
         
         if not search_results['parts'].empty:
             st.subheader("Parts")
-            st.dataframe(search_results['parts'][['part_name', 'part_number', 'quantity', 'client_phone', 'vin_number']], use_container_width=True)
+            st.dataframe(search_results['parts'][['part_name', 'part_number', 'quantity', 'client_phone', 'vin_number', 'snippet']], use_container_width=True)
         
         if search_results['clients'].empty and search_results['vins'].empty and search_results['parts'].empty:
             st.info("No results found for your search.")
@@ -2,44 +2,127 @@
 from datetime import datetime
 import streamlit as st
 import hashlib
-import sqlite3
 import os
 import json
+import queue
+import threading
+import time
+import atexit
+from db_utils import read_connection, run_write, now_ms
 
-# Use relative path for Streamlit Cloud
-DB_NAME = 'brent_j_marketing.db'
+# Activity log entries are written in batches of up to LOG_BATCH_SIZE, at
+# most LOG_FLUSH_INTERVAL seconds after the first entry of a batch arrived.
+# Once LOG_QUEUE_SIZE entries are waiting, log_activity() blocks until the
+# writer catches up.
+LOG_BATCH_SIZE = 50
+LOG_FLUSH_INTERVAL = 1.0
+LOG_QUEUE_SIZE = 1000
 
-def get_db_connection():
-    """Get database connection"""
-    try:
-        conn = sqlite3.connect(DB_NAME)
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
-    except Exception as e:
-        print(f"Failed to connect to the database: {e}")
-        return None
+_STOP = object()
+
+class ActivityLogWriter:
+    """
+    Background writer for the activity log.
+    
+    Entries are queued by log_activity() and inserted by a daemon thread with
+    one executemany per batch, so a user action never waits for a log commit.
+    Pending entries are flushed when the process exits.
+    """
+    
+    def __init__(self, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL, max_pending=LOG_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.entries = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+    
+    def put(self, entry):
+        """Queue one activity_log row, blocking while the queue is full."""
+        self.entries.put(entry)
+    
+    def flush(self):
+        """
+        Block until every entry queued so far has been written.
+        
+        A marker event is queued behind them and set once its batch is
+        written, so entries other sessions queue afterwards are not waited for.
+        """
+        if not self.thread.is_alive():
+            return
+        marker = threading.Event()
+        self.entries.put(marker)
+        marker.wait()
+    
+    def close(self):
+        """Write any pending entries and stop the writer thread."""
+        if self.thread.is_alive():
+            self.entries.put(_STOP)
+            self.thread.join()
+    
+    def _collect(self):
+        """Wait for one entry, then gather more until the batch is full or the interval ends."""
+        batch = [self.entries.get()]
+        deadline = time.monotonic() + self.flush_interval
+        # A stop or flush marker ends the batch so it is written right away
+        while len(batch) < self.batch_size and isinstance(batch[-1], tuple):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.entries.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch = self._collect()
+            rows = [entry for entry in batch if isinstance(entry, tuple)]
+            markers = [entry for entry in batch if isinstance(entry, threading.Event)]
+            stopped = _STOP in batch
+            try:
+                if rows:
+                    run_write(lambda conn: conn.executemany(
+                        '''INSERT INTO activity_log (timestamp, username, action, details, table_name, record_id, old_values, new_values) 
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                        rows
+                    ))
+            except Exception as e:
+                print(f"Error logging activity: {e}")
+            finally:
+                for marker in markers:
+                    marker.set()
+
+@st.cache_resource
+def get_log_writer():
+    """Create the activity log writer once per server process."""
+    return ActivityLogWriter()
+
+def flush_activity_log():
+    """Wait until all queued activity log entries are in the database."""
+    get_log_writer().flush()
 
 def authenticate_user(username, password):
     """Authenticate user credentials with hashing"""
-    conn = get_db_connection()
-    if conn is None:
-        return False, None
-    
     try:
         # Hash the provided password
         password_hash = hashlib.sha256(password.encode()).hexdigest()
         
-        cursor = conn.cursor()
-        cursor.execute("SELECT password_hash, role FROM users WHERE username = ?", (username,))
-        result = cursor.fetchone()
+        with read_connection() as conn:
+            result = conn.execute(
+                "SELECT password_hash, role FROM users WHERE username = ?", (username,)
+            ).fetchone()
         
         if result:
             # Compare hashed passwords
             if result[0] == password_hash:
                 # Update last login
-                cursor.execute("UPDATE users SET last_login = ? WHERE username = ?", 
-                             (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), username))
-                conn.commit()
+                last_login = now_ms()
+                run_write(lambda conn: conn.execute(
+                    "UPDATE users SET last_login = ? WHERE username = ?", (last_login, username)
+                ))
                 return True, result[1]
         return False, None
     except Exception as e:
@@ -48,14 +131,9 @@ def authenticate_user(username, password):
 
 def get_user_role(username):
     """Get user role"""
-    conn = get_db_connection()
-    if conn is None:
-        return None
-    
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT role FROM users WHERE username = ?", (username,))
-        result = cursor.fetchone()
+        with read_connection() as conn:
+            result = conn.execute("SELECT role FROM users WHERE username = ?", (username,)).fetchone()
         return result[0] if result else None
     except Exception as e:
         print(f"Error getting user role: {e}")
@@ -63,19 +141,13 @@ def get_user_role(username):
 
 def log_activity(username, action, details, table_name=None, record_id=None, old_values=None, new_values=None):
     """Log user activities to database with detailed tracking"""
-    conn = get_db_connection()
-    if conn is None:
-        return
     try:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        conn.execute(
-            '''INSERT INTO activity_log (timestamp, username, action, details, table_name, record_id, old_values, new_values) 
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+        timestamp = now_ms()
+        get_log_writer().put(
             (timestamp, username, action, details, table_name, record_id, 
              json.dumps(old_values) if old_values else None,
              json.dumps(new_values) if new_values else None)
         )
-        conn.commit()
     except Exception as e:
         print(f"Error logging activity: {e}")
 
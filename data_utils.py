@@ -40,4 +40,131 @@ def safe_get_first_row(df, condition, default=None):
             return default
         return filtered.iloc[0]
     except (KeyError, IndexError):
-        return default
\ No newline at end of file
+        return default
+
+class GroupIndex:
+    """
+    Lookup from the values of one column to the rows holding them
+    
+    Built with a single groupby pass, so each lookup is a dictionary hit
+    instead of a boolean mask over the whole DataFrame.
+    
+    Args:
+        df: DataFrame to index
+        column: Column whose values become the lookup keys
+    """
+    
+    def __init__(self, df, column):
+        self.df = df
+        if df.empty or column not in df.columns:
+            self.groups = {}
+        else:
+            self.groups = df.groupby(column, sort=False).indices
+    
+    def get(self, key):
+        """Return the rows matching key, or an empty DataFrame"""
+        positions = self.groups.get(key)
+        if positions is None:
+            return self.df.iloc[0:0]
+        return self.df.iloc[positions]
+    
+    def first(self, key, default=None):
+        """Return the first row matching key, or default"""
+        positions = self.groups.get(key)
+        if positions is None:
+            return default
+        return self.df.iloc[positions[0]]
+
+
+class DataIndex:
+    """
+    Lookup indexes over the clients, vins, parts and part_suppliers frames
+    
+    Frames are requested from get_frame only when a lookup needs them, and
+    each GroupIndex is built the first time it is used.
+    
+    Args:
+        get_frame: Callable returning the DataFrame for a table name
+        get_index: Optional callable (table, column, frame) -> GroupIndex,
+            used to share indexes between DataIndex instances
+    """
+    
+    def __init__(self, get_frame, get_index=None):
+        self.get_frame = get_frame
+        self.get_index = get_index
+        self._indexes = {}
+    
+    @classmethod
+    def from_frames(cls, df_clients, df_vins, df_parts, df_part_suppliers):
+        """Build a DataIndex over frames that are already loaded"""
+        frames = {
+            'clients': df_clients,
+            'vins': df_vins,
+            'parts': df_parts,
+            'part_suppliers': df_part_suppliers,
+        }
+        return cls(frames.__getitem__)
+    
+    @property
+    def df_clients(self):
+        return self.get_frame('clients')
+    
+    @property
+    def df_vins(self):
+        return self.get_frame('vins')
+    
+    @property
+    def df_parts(self):
+        return self.get_frame('parts')
+    
+    @property
+    def df_part_suppliers(self):
+        return self.get_frame('part_suppliers')
+    
+    def _index(self, table, column):
+        key = (table, column)
+        index = self._indexes.get(key)
+        if index is None:
+            frame = self.get_frame(table)
+            if self.get_index is not None:
+                index = self.get_index(table, column, frame)
+            else:
+                index = GroupIndex(frame, column)
+            self._indexes[key] = index
+        return index
+    
+    def client_phones(self):
+        """Return the sorted list of client phone numbers"""
+        return sorted(self._index('clients', 'phone').groups)
+    
+    def get_client(self, phone):
+        """Return the client row for a phone number, or None"""
+        return self._index('clients', 'phone').first(phone)
+    
+    def get_client_by_id(self, client_id):
+        """Return the client row for a client ID, or None"""
+        return self._index('clients', 'id').first(client_id)
+    
+    def get_vin(self, vin_number):
+        """Return the VIN row for a VIN number, or None"""
+        return self._index('vins', 'vin_number').first(vin_number)
+    
+    def get_part(self, part_id):
+        """Return the part row for a part ID, or None"""
+        return self._index('parts', 'id').first(part_id)
+    
+    def vins_for_client(self, client_id):
+        return self._index('vins', 'client_id').get(client_id)
+    
+    def parts_for_client(self, client_id):
+        return self._index('parts', 'client_id').get(client_id)
+    
+    def unassigned_parts_for_client(self, client_id):
+        parts = self.parts_for_client(client_id)
+        return parts[parts['vin_number'].isnull()]
+    
+    def parts_for_vin(self, vin_number):
+        return self._index('parts', 'vin_number').get(vin_number)
+    
+    def suppliers_for_part(self, part_id):
+        return self._index('part_suppliers', 'part_id').get(part_id)
@@ -8,180 +8,1477 @@ import zipfile
 from datetime import datetime
 import json
 import hashlib
+import re
+import threading
+import time
+import queue
+from concurrent.futures import Future
+from contextlib import contextmanager
+from collections import OrderedDict
+from data_utils import GroupIndex, DataIndex
+from security import normalize_phone, normalize_vin
 
 # Use relative path for Streamlit Cloud
 DB_NAME = 'brent_j_marketing.db'
 
-@st.cache_resource
-def get_db_connection():
+# Tables kept in memory by load_data(), with the primary key used to patch them
+CACHED_TABLES = {
+    'clients': 'id',
+    'vins': 'vin_number',
+    'parts': 'id',
+    'part_suppliers': 'id',
+}
+
+# Child rows removed by ON DELETE CASCADE: parent table -> [(child table, foreign key)]
+CASCADES = {
+    'clients': [('vins', 'client_id'), ('parts', 'client_id')],
+    'vins': [('parts', 'vin_number')],
+    'parts': [('part_suppliers', 'part_id')],
+}
+
+# Columns ClientBundleCache.invalidate matches changed rows on, per cached table
+BUNDLE_MATCH_COLUMNS = {
+    'clients': ['id'],
+    'vins': ['vin_number', 'client_id'],
+    'parts': ['id', 'client_id'],
+    'part_suppliers': ['id', 'part_id'],
+}
+
+# In-memory dtypes for the cached tables. Repeated text is stored as
+# categoricals, quantities as nullable small ints and timestamps as datetimes;
+# anything not listed keeps the dtype read_sql_query gives it.
+_AUDIT_DTYPES = {
+    'created_date': 'datetime',
+    'last_updated': 'datetime',
+    'created_by': 'category',
+    'last_updated_by': 'category',
+}
+TABLE_DTYPES = {
+    'clients': dict(_AUDIT_DTYPES),
+    'vins': dict(_AUDIT_DTYPES, client_id='Int64', model='category', prod_yr='category', body='category',
+                 engine='category', code='category', transmission='category'),
+    'parts': dict(_AUDIT_DTYPES, client_id='Int64', quantity='Int32', date_added='datetime'),
+    'part_suppliers': dict(_AUDIT_DTYPES, supplier_name='category', delivery_time='category'),
+}
+
+# Columns covered by full-text search. Each table gets an external-content
+# FTS5 table named <table>_fts, keyed by the table's rowid and kept in sync
+# by triggers.
+SEARCH_COLUMNS = {
+    'clients': ['client_name', 'phone'],
+    'vins': ['vin_number', 'model'],
+    'parts': ['part_name', 'part_number', 'notes'],
+}
+
+# Columns searched by fragment (any substring of three or more characters),
+# indexed the same way in trigram-tokenized FTS5 tables named <table>_trigram.
+# Phones are indexed by their digits only so separators never split a match.
+FRAGMENT_COLUMNS = {
+    'clients': 'phone_key',
+    'vins': 'vin_number',
+    'parts': 'part_number',
+}
+
+# Normalized lookup keys: table -> (key column, source column, normalizer).
+# Keys are unique, so equal phones or VINs in different formats are rejected.
+LOOKUP_KEYS = {
+    'clients': ('phone_key', 'phone', normalize_phone),
+    'vins': ('vin_key', 'vin_number', normalize_vin),
+}
+
+# Per-client bundles kept by logic.get_client_bundle(), least recently used dropped first
+CLIENT_BUNDLE_CACHE_SIZE = 64
+
+# Tombstones older than this are pruned by database_maintenance(); a snapshot
+# that has not been refreshed for this long is rebuilt from scratch instead.
+TOMBSTONE_RETENTION_DAYS = 7
+
+# Read-only connections shared by all sessions; callers wait when all are in use
+READER_POOL_SIZE = 4
+
+# Timestamps are stored as INTEGER milliseconds since the Unix epoch (UTC).
+# Columns: table -> {column: zone its old TEXT values were written in}. SQL
+# defaults used UTC CURRENT_TIMESTAMP; values written from Python used local time.
+TIMESTAMP_COLUMNS = {
+    'clients': {'created_date': 'utc', 'last_updated': 'utc'},
+    'vins': {'created_date': 'utc', 'last_updated': 'utc'},
+    'parts': {'created_date': 'utc', 'last_updated': 'utc', 'date_added': 'local'},
+    'part_suppliers': {'created_date': 'utc', 'last_updated': 'utc'},
+    'users': {'created_date': 'utc', 'last_login': 'local'},
+    'activity_log': {'timestamp': 'local'},
+    'deleted_rows': {'deleted_at': 'utc'},
+}
+
+# SQL expression for the current time in epoch milliseconds
+NOW_MS_SQL = "CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)"
+
+# SET clause for updates that maintain last_updated and version themselves,
+# so their RETURNING rows already carry the final values
+TOUCH_SQL = f"last_updated = {NOW_MS_SQL}, version = version + 1"
+
+def now_ms():
+    """Return the current time in epoch milliseconds."""
+    return int(time.time() * 1000)
+
+def to_epoch_ms(value):
+    """Convert a naive local datetime, or a date taken as its midnight, to epoch milliseconds."""
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    return int(value.timestamp() * 1000)
+
+def epoch_ms_to_datetime(values):
+    """Convert a Series of epoch milliseconds to naive local datetimes for display."""
+    local_zone = datetime.now().astimezone().tzinfo
+    return pd.to_datetime(values, unit='ms', utc=True, errors='coerce').dt.tz_convert(local_zone).dt.tz_localize(None)
+
+def _connect(read_only=False):
+    """Open a connection with the pragmas every connection needs."""
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA busy_timeout = 3000")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+class ConnectionManager:
     """
-    Establishes and caches a single database connection.
-    This ensures the connection is reused across reruns for performance.
+    A bounded pool of WAL reader connections and one dedicated writer.
+    
+    Readers are checked out with reader(). Writes are queued to a single
+    writer thread that owns the only write connection, runs each job in its
+    own transaction and hands the result (or the exception) back to the
+    caller, so sessions never contend for the write lock. In WAL mode the
+    readers keep reading while a write is in progress.
     """
+    
+    def __init__(self, pool_size=READER_POOL_SIZE):
+        writer_conn = _connect()
+        writer_conn.execute("PRAGMA journal_mode = WAL")
+        self.readers = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self.readers.put(_connect(read_only=True))
+        self.jobs = queue.Queue()
+        self.writer = threading.Thread(
+            target=self._run_writer, args=(writer_conn,), name='db-writer', daemon=True
+        )
+        self.writer.start()
+    
+    @contextmanager
+    def reader(self):
+        """Check out a reader connection for the duration of the with block."""
+        conn = self.readers.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.readers.put(conn)
+    
+    def write(self, job):
+        """Run job(conn) on the writer connection in one transaction and return its result."""
+        if threading.current_thread() is self.writer:
+            raise RuntimeError("write() called from inside a write job")
+        future = Future()
+        self.jobs.put((job, future))
+        return future.result()
+    
+    def _run_writer(self, conn):
+        while True:
+            job, future = self.jobs.get()
+            try:
+                result = job(conn)
+                conn.commit()
+            except BaseException as e:
+                conn.rollback()
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+@st.cache_resource
+def get_connection_manager():
+    """Create the connection manager once per server process."""
     try:
-        conn = sqlite3.connect(DB_NAME, check_same_thread=False)
-        conn.execute("PRAGMA foreign_keys = ON")
-        conn.execute("PRAGMA busy_timeout = 3000")
-        conn.execute("PRAGMA journal_mode = WAL")
-        return conn
+        return ConnectionManager()
     except Exception as e:
         print(f"Failed to connect to the database: {e}")
         return None
 
-def create_tables():
-    """Initializes the SQLite database and creates the necessary tables."""
-    conn = get_db_connection()
-    if conn is None:
-        return
+@contextmanager
+def read_connection():
+    """Check out a pooled reader connection."""
+    manager = get_connection_manager()
+    if manager is None:
+        raise ConnectionError("Database connection not available")
+    with manager.reader() as conn:
+        yield conn
+
+def run_write(job):
+    """Run job(conn) on the single writer connection and return its result."""
+    manager = get_connection_manager()
+    if manager is None:
+        raise ConnectionError("Database connection not available")
+    return manager.write(job)
+
+def _create_tombstone_triggers(cursor, keys):
+    """
+    Record a tombstone whenever a cached row is deleted or its key changes.
     
-    try:
-        cursor = conn.cursor()
-        
-        # Create users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT DEFAULT 'user',
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP,
-                last_login TEXT
-            )
+    Rows without a key (vehicles added without a VIN) are never in a
+    snapshot, so they need no tombstone.
+    """
+    for table, key in keys.items():
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_tombstone
+            AFTER DELETE ON {table}
+            WHEN OLD.{key} IS NOT NULL
+            BEGIN
+                INSERT INTO deleted_rows (table_name, row_key) VALUES ('{table}', OLD.{key});
+            END
         ''')
-        
-        # Create clients table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS clients (
-                phone TEXT PRIMARY KEY,
-                client_name TEXT,
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP,
-                last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
-                created_by TEXT,
-                last_updated_by TEXT
-            )
+        if key != 'id':
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_rekey_tombstone
+                AFTER UPDATE OF {key} ON {table}
+                WHEN OLD.{key} IS NOT NEW.{key} AND OLD.{key} IS NOT NULL
+                BEGIN
+                    INSERT INTO deleted_rows (table_name, row_key) VALUES ('{table}', OLD.{key});
+                END
+            ''')
+
+def _create_touch_triggers(cursor):
+    """
+    Stamp last_updated and bump version on every update of a cached table.
+    
+    Updates that bump version themselves (see TOUCH_SQL) are left alone; any
+    other update gets a new version, and the current time unless it set
+    last_updated itself. RETURNING does not see changes made by AFTER
+    triggers, so mutators that return rows should use TOUCH_SQL.
+    """
+    for table in CACHED_TABLES:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_touch
+            AFTER UPDATE ON {table}
+            WHEN NEW.version IS OLD.version
+            BEGIN
+                UPDATE {table}
+                SET last_updated = CASE WHEN NEW.last_updated IS OLD.last_updated
+                                        THEN {NOW_MS_SQL} ELSE NEW.last_updated END,
+                    version = OLD.version + 1
+                WHERE rowid = NEW.rowid;
+            END
         ''')
+
+def _create_change_counter_triggers(cursor):
+    """Bump a cached table's change_counters row on every insert, update and delete."""
+    for table in CACHED_TABLES:
+        cursor.execute("INSERT OR IGNORE INTO change_counters (table_name) VALUES (?)", (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_count_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE change_counters SET counter = counter + 1 WHERE table_name = '{table}';
+                END
+            ''')
+
+def _create_lookup_key_indexes(cursor):
+    """Index phone_key and vin_key, uniquely unless existing rows collide."""
+    for table, (key_column, _, _) in LOOKUP_KEYS.items():
+        index = f"idx_{table}_{key_column}"
+        try:
+            cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table}({key_column})")
+        except sqlite3.IntegrityError:
+            # Existing rows that only differ in formatting have to be merged by hand
+            print(f"Duplicate {key_column} values in {table}; creating a non-unique index")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table}({key_column})")
+
+def _migrate_base_schema(conn):
+    """Create the tables, tombstone triggers, indexes and the default admin user."""
+    cursor = conn.cursor()
+    
+    # Create users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT DEFAULT 'user',
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_login TEXT
+        )
+    ''')
+    
+    # Create clients table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS clients (
+            phone TEXT PRIMARY KEY,
+            client_name TEXT,
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            last_updated_by TEXT
+        )
+    ''')
+    
+    # Create vins table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vins (
+            vin_number TEXT PRIMARY KEY,
+            client_phone TEXT,
+            model TEXT,
+            prod_yr TEXT,
+            body TEXT,
+            engine TEXT,
+            code TEXT,
+            transmission TEXT,
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            last_updated_by TEXT,
+            FOREIGN KEY(client_phone) REFERENCES clients(phone) ON DELETE CASCADE
+        )
+    ''')
+    
+    # Create parts table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS parts (
+            id INTEGER PRIMARY KEY,
+            vin_number TEXT,
+            client_phone TEXT,
+            part_name TEXT,
+            part_number TEXT,
+            quantity INTEGER,
+            notes TEXT,
+            date_added TEXT,
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            last_updated_by TEXT,
+            FOREIGN KEY(vin_number) REFERENCES vins(vin_number) ON DELETE CASCADE,
+            FOREIGN KEY(client_phone) REFERENCES clients(phone) ON DELETE CASCADE
+        )
+    ''')
+    
+    # Create part_suppliers table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS part_suppliers (
+            id INTEGER PRIMARY KEY,
+            part_id INTEGER,
+            supplier_name TEXT,
+            buying_price REAL,
+            selling_price REAL,
+            delivery_time TEXT,
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            last_updated_by TEXT,
+            FOREIGN KEY(part_id) REFERENCES parts(id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # Create activity_log table for system administration
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS activity_log (
+            id INTEGER PRIMARY KEY,
+            timestamp TEXT,
+            username TEXT,
+            action TEXT,
+            details TEXT,
+            table_name TEXT,
+            record_id TEXT,
+            old_values TEXT,
+            new_values TEXT
+        )
+    ''')
+    
+    # Create deleted_rows table so incremental loads can see deletions
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS deleted_rows (
+            id INTEGER PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            row_key TEXT NOT NULL,
+            deleted_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # The cached tables' keys at this version; clients moved to id in version 5
+    _create_tombstone_triggers(cursor, {
+        'clients': 'phone',
+        'vins': 'vin_number',
+        'parts': 'id',
+        'part_suppliers': 'id',
+    })
+    
+    # Add indexes
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vins_client_phone ON vins(client_phone)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_parts_client_phone ON parts(client_phone)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_parts_vin_number ON parts(vin_number)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_part_suppliers_part_id ON part_suppliers(part_id)')
+    # Keyset pagination walks these in (last_updated, key) order
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_clients_last_updated ON clients(last_updated, phone)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_parts_last_updated ON parts(last_updated, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_log_timestamp ON activity_log(timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_log_username ON activity_log(username)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_deleted_rows_table_name ON deleted_rows(table_name, id)')
+    
+    # Create default admin user
+    admin_password_hash = hashlib.sha256("admin".encode()).hexdigest()
+    cursor.execute('''
+        INSERT OR IGNORE INTO users (username, password_hash, role) 
+        VALUES (?, ?, ?)
+    ''', ('admin', admin_password_hash, 'admin'))
+
+def _migrate_drop_deposit_balance(conn):
+    """Remove deprecated columns from parts and fill in missing timestamps."""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(parts)")
+    columns = [col[1] for col in cursor.fetchall()]
+    
+    if 'deposit' in columns:
+        cursor.execute("ALTER TABLE parts DROP COLUMN deposit;")
+    if 'balance' in columns:
+        cursor.execute("ALTER TABLE parts DROP COLUMN balance;")
+    
+    # Rows without last_updated would be skipped by keyset pagination
+    for table in CACHED_TABLES:
+        cursor.execute(
+            f"UPDATE {table} SET last_updated = COALESCE(created_date, CURRENT_TIMESTAMP) WHERE last_updated IS NULL"
+        )
+
+def _migrate_lookup_keys(conn):
+    """Add and backfill the normalized phone_key and vin_key columns."""
+    cursor = conn.cursor()
+    for table, (key_column, _, _) in LOOKUP_KEYS.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        if key_column not in [col[1] for col in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {key_column} TEXT")
+    backfill_lookup_keys(conn)
+    _create_lookup_key_indexes(cursor)
+
+def _search_tables():
+    """List (fts table, content table, columns, tokenizer) for every search index."""
+    return (
+        [(f"{table}_fts", table, columns, 'unicode61') for table, columns in SEARCH_COLUMNS.items()] +
+        [(f"{table}_trigram", table, [column], 'trigram') for table, column in FRAGMENT_COLUMNS.items()]
+    )
+
+def _migrate_search_index(conn):
+    """Create the FTS5 search tables and the triggers that keep them in sync."""
+    cursor = conn.cursor()
+    for fts, table, columns, tokenizer in _search_tables():
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f"new.{col}" for col in columns)
+        old_values = ', '.join(f"old.{col}" for col in columns)
+        exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone()
         
-        # Create vins table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS vins (
-                vin_number TEXT PRIMARY KEY,
-                client_phone TEXT,
-                model TEXT,
-                prod_yr TEXT,
-                body TEXT,
-                engine TEXT,
-                code TEXT,
-                transmission TEXT,
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP,
-                last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
-                created_by TEXT,
-                last_updated_by TEXT,
-                FOREIGN KEY(client_phone) REFERENCES clients(phone) ON DELETE CASCADE
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts}
+            USING fts5({column_list}, content='{table}', content_rowid='rowid', tokenize='{tokenizer}')
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO {fts}(rowid, {column_list}) VALUES (new.rowid, {new_values});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.rowid, {old_values});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {column_list} ON {table}
+            BEGIN
+                INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.rowid, {old_values});
+                INSERT INTO {fts}(rowid, {column_list}) VALUES (new.rowid, {new_values});
+            END
+        """)
+        if not exists:
+            # Index the rows that were there before the search table
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+def _migrate_client_id(conn):
+    """
+    Key clients by an INTEGER id instead of their phone number.
+    
+    clients, vins and parts are rebuilt: clients gets an id primary key and
+    keeps phone as a unique column, and vins and parts point at the client
+    through client_id instead of repeating the phone. Client ids are the old
+    rowids and vins keep their rowids, so the search indexes stay valid.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE clients_new (
+            id INTEGER PRIMARY KEY,
+            phone TEXT UNIQUE NOT NULL,
+            client_name TEXT,
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            last_updated_by TEXT,
+            phone_key TEXT
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO clients_new (id, phone, client_name, created_date, last_updated, created_by, last_updated_by, phone_key)
+        SELECT rowid, phone, client_name, created_date, last_updated, created_by, last_updated_by, phone_key
+        FROM clients
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE vins_new (
+            vin_number TEXT PRIMARY KEY,
+            client_id INTEGER,
+            model TEXT,
+            prod_yr TEXT,
+            body TEXT,
+            engine TEXT,
+            code TEXT,
+            transmission TEXT,
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            last_updated_by TEXT,
+            vin_key TEXT,
+            FOREIGN KEY(client_id) REFERENCES clients(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO vins_new (rowid, vin_number, client_id, model, prod_yr, body, engine, code, transmission,
+                              created_date, last_updated, created_by, last_updated_by, vin_key)
+        SELECT v.rowid, v.vin_number, c.id, v.model, v.prod_yr, v.body, v.engine, v.code, v.transmission,
+               v.created_date, v.last_updated, v.created_by, v.last_updated_by, v.vin_key
+        FROM vins v LEFT JOIN clients_new c ON c.phone = v.client_phone
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE parts_new (
+            id INTEGER PRIMARY KEY,
+            vin_number TEXT,
+            client_id INTEGER,
+            part_name TEXT,
+            part_number TEXT,
+            quantity INTEGER,
+            notes TEXT,
+            date_added TEXT,
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            last_updated_by TEXT,
+            FOREIGN KEY(vin_number) REFERENCES vins(vin_number) ON DELETE CASCADE,
+            FOREIGN KEY(client_id) REFERENCES clients(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO parts_new (id, vin_number, client_id, part_name, part_number, quantity, notes, date_added,
+                               created_date, last_updated, created_by, last_updated_by)
+        SELECT p.id, p.vin_number, c.id, p.part_name, p.part_number, p.quantity, p.notes, p.date_added,
+               p.created_date, p.last_updated, p.created_by, p.last_updated_by
+        FROM parts p LEFT JOIN clients_new c ON c.phone = p.client_phone
+    ''')
+    
+    # Dropping the old tables also drops their indexes and triggers
+    for table in ('parts', 'vins', 'clients'):
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vins_client_id ON vins(client_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_parts_client_id ON parts(client_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_parts_vin_number ON parts(vin_number)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_clients_last_updated ON clients(last_updated, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_parts_last_updated ON parts(last_updated, id)')
+    _create_lookup_key_indexes(cursor)
+    _create_tombstone_triggers(cursor, CACHED_TABLES)
+    _migrate_search_index(conn)
+    # Client tombstones recorded phones, which are no longer row keys
+    cursor.execute("DELETE FROM deleted_rows WHERE table_name = 'clients'")
+
+def _retype_timestamp_columns(conn, table, columns):
+    """
+    Rebuild table with columns declared INTEGER, and CURRENT_TIMESTAMP
+    defaults replaced by the epoch-millisecond clock.
+    
+    SQLite cannot change a column's type in place, so the rows (rowids
+    included) are copied into a table created from the edited definition,
+    and the indexes and triggers are recreated from their stored SQL.
+    """
+    cursor = conn.cursor()
+    table_sql = cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()[0]
+    dependents = [row[0] for row in cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()]
+    column_list = ', '.join(col[1] for col in cursor.execute(f"PRAGMA table_info({table})").fetchall())
+    
+    new_sql = re.sub(rf'^CREATE TABLE (IF NOT EXISTS )?"?{table}"?', f'CREATE TABLE {table}_new', table_sql.strip())
+    for column in columns:
+        new_sql = re.sub(
+            rf'\b{column}\s+TEXT(\s+DEFAULT\s+CURRENT_TIMESTAMP)?',
+            lambda match: f"{column} INTEGER" + (f" DEFAULT ({NOW_MS_SQL})" if match.group(1) else ""),
+            new_sql
+        )
+    cursor.execute(new_sql)
+    cursor.execute(f"INSERT INTO {table}_new (rowid, {column_list}) SELECT rowid, {column_list} FROM {table}")
+    cursor.execute(f"DROP TABLE {table}")
+    # Triggers on other tables may name this one; don't re-check them mid-swap
+    cursor.execute("PRAGMA legacy_alter_table = ON")
+    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    cursor.execute("PRAGMA legacy_alter_table = OFF")
+    for sql in dependents:
+        cursor.execute(sql)
+
+def _migrate_epoch_timestamps(conn):
+    """Store every timestamp as INTEGER epoch milliseconds and index activity_log for range queries."""
+    cursor = conn.cursor()
+    for table, columns in TIMESTAMP_COLUMNS.items():
+        _retype_timestamp_columns(conn, table, columns)
+    backfill_epoch_timestamps(conn)
+    
+    # Filters on user or action read one contiguous time range of the index
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_log_username_ts ON activity_log(username, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_log_action_ts ON activity_log(action, timestamp)')
+    cursor.execute('DROP INDEX IF EXISTS idx_activity_log_username')
+
+def _migrate_row_versions(conn):
+    """Add a per-row version to the cached tables and maintain it and last_updated by trigger."""
+    cursor = conn.cursor()
+    for table in CACHED_TABLES:
+        columns = [col[1] for col in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+        if 'version' not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    _create_touch_triggers(cursor)
+
+def _migrate_change_counters(conn):
+    """Count writes per cached table so other processes' commits can be detected cheaply."""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_counters (
+            table_name TEXT PRIMARY KEY,
+            counter INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    _create_change_counter_triggers(cursor)
+
+def _migrate_phone_fragment_index(conn):
+    """Rebuild the clients fragment index over phone_key instead of the formatted phone."""
+    cursor = conn.cursor()
+    for event in ('insert', 'delete', 'update'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_clients_trigram_{event}")
+    cursor.execute("DROP TABLE IF EXISTS clients_trigram")
+    _migrate_search_index(conn)
+
+def _migrate_last_updated_indexes(conn):
+    """Index last_updated on every cached table so snapshot deltas are range scans."""
+    cursor = conn.cursor()
+    for table in CACHED_TABLES:
+        # clients and parts already have a (last_updated, id) index under this name
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_last_updated ON {table}(last_updated)")
+
+def _migrate_null_key_tombstones(conn):
+    """Recreate the tombstone triggers so deleting a row without a key does not fail."""
+    cursor = conn.cursor()
+    for table in CACHED_TABLES:
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_tombstone")
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_rekey_tombstone")
+    _create_tombstone_triggers(cursor, CACHED_TABLES)
+
+# Ordered schema migrations. Each one runs once, in its own transaction, and
+# the database records the last applied number in PRAGMA user_version. Append
+# new migrations to the end; never renumber or edit one that has shipped.
+# The first four are written to be safe on databases created before
+# versioning existed.
+MIGRATIONS = [
+    (1, "base schema", _migrate_base_schema),
+    (2, "drop parts deposit and balance", _migrate_drop_deposit_balance),
+    (3, "normalized lookup keys", _migrate_lookup_keys),
+    (4, "full-text search index", _migrate_search_index),
+    (5, "integer client ids", _migrate_client_id),
+    (6, "epoch millisecond timestamps", _migrate_epoch_timestamps),
+    (7, "row versions", _migrate_row_versions),
+    (8, "change counters", _migrate_change_counters),
+    (9, "phone key fragment index", _migrate_phone_fragment_index),
+    (10, "last_updated indexes", _migrate_last_updated_indexes),
+    (11, "tombstones skip rows without a key", _migrate_null_key_tombstones),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_migration_lock = threading.Lock()
+_schema_version = None
+
+def _apply_migrations(conn):
+    """Apply every migration newer than the database's user_version."""
+    applied = []
+    # Tables are rebuilt by dropping and renaming them, which must not
+    # cascade into their children; keys are checked before each commit instead
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for version, description, migrate in MIGRATIONS:
+            # Take the write lock before checking, so a second process that
+            # raced us sees our version instead of migrating again
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version > current:
+                    migrate(conn)
+                    if conn.execute("PRAGMA foreign_key_check").fetchone():
+                        raise sqlite3.IntegrityError(f"Migration {version} left dangling foreign keys")
+                    conn.execute(f"PRAGMA user_version = {int(version)}")
+                    applied.append(description)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+    return conn.execute("PRAGMA user_version").fetchone()[0], applied
+
+def run_migrations():
+    """
+    Bring the database schema up to SCHEMA_VERSION.
+    
+    Runs at most once per server process: later calls return straight away.
+    The first caller holds a lock while it checks PRAGMA user_version and
+    applies any pending migrations, so concurrent sessions wait for it
+    instead of migrating twice.
+    
+    Returns:
+        int: The schema version, or None if the migrations failed
+    """
+    global _schema_version
+    if _schema_version == SCHEMA_VERSION:
+        return _schema_version
+    
+    with _migration_lock:
+        if _schema_version == SCHEMA_VERSION:
+            return _schema_version
+        try:
+            with read_connection() as conn:
+                current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current < SCHEMA_VERSION:
+                current, applied = run_write(_apply_migrations)
+                for description in applied:
+                    print(f"Applied schema migration: {description}")
+            if current > SCHEMA_VERSION:
+                print(f"Database schema version {current} is newer than this app ({SCHEMA_VERSION})")
+            _schema_version = current
+            return current
+        except (sqlite3.Error, ConnectionError) as e:
+            print(f"Migration error: {e}")
+            return None
+
+def backfill_lookup_keys(conn):
+    """Fill in phone_key and vin_key for rows written without them."""
+    for table, (key_column, source_column, normalize) in LOOKUP_KEYS.items():
+        rows = conn.execute(
+            f"SELECT rowid, {source_column} FROM {table} WHERE {key_column} IS NULL AND {source_column} IS NOT NULL"
+        ).fetchall()
+        if rows:
+            conn.executemany(
+                f"UPDATE {table} SET {key_column} = ? WHERE rowid = ?",
+                [(normalize(value) or None, rowid) for rowid, value in rows]
             )
-        ''')
-        
-        # Create parts table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS parts (
-                id INTEGER PRIMARY KEY,
-                vin_number TEXT,
-                client_phone TEXT,
-                part_name TEXT,
-                part_number TEXT,
-                quantity INTEGER,
-                notes TEXT,
-                date_added TEXT,
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP,
-                last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
-                created_by TEXT,
-                last_updated_by TEXT,
-                FOREIGN KEY(vin_number) REFERENCES vins(vin_number) ON DELETE CASCADE,
-                FOREIGN KEY(client_phone) REFERENCES clients(phone) ON DELETE CASCADE
+
+def backfill_epoch_timestamps(conn):
+    """Convert timestamps still stored as TEXT to epoch milliseconds."""
+    for table, columns in TIMESTAMP_COLUMNS.items():
+        assignments = []
+        for column, zone in columns.items():
+            # The 'utc' modifier reads the text as local time and shifts it to UTC
+            modifier = ", 'utc'" if zone == 'local' else ""
+            assignments.append(
+                f"{column} = CASE WHEN typeof({column}) = 'text' "
+                f"THEN CAST(ROUND((julianday({column}{modifier}) - 2440587.5) * 86400000) AS INTEGER) "
+                f"ELSE {column} END"
             )
-        ''')
+        # One statement per table: a converted last_updated is then kept by
+        # the touch trigger instead of being replaced with the current time
+        conn.execute(f"""
+            UPDATE {table} SET {', '.join(assignments)}
+            WHERE {' OR '.join(f"typeof({column}) = 'text'" for column in columns)}
+        """)
+
+def _apply_dtypes(table, frame, like=None):
+    """
+    Convert a frame read from SQLite to the compact dtypes in TABLE_DTYPES.
+    
+    When like is given, categorical columns reuse (and extend) its categories
+    so the result can be combined with it without falling back to object.
+    """
+    frame = frame.copy()
+    for column, dtype in TABLE_DTYPES.get(table, {}).items():
+        if column not in frame.columns:
+            continue
+        if dtype == 'datetime':
+            frame[column] = epoch_ms_to_datetime(frame[column])
+        elif dtype == 'category':
+            categories = None
+            if like is not None and column in like.columns:
+                existing = like[column].cat.categories
+                categories = existing.append(pd.Index(frame[column].dropna().unique()).difference(existing))
+            frame[column] = pd.Categorical(frame[column], categories=categories)
+        else:
+            frame[column] = frame[column].astype(dtype)
+    return frame
+
+def _patch_rows(table, frame, changed=None, deleted_keys=()):
+    """
+    Return a copy of frame with deleted_keys removed and changed rows upserted.
+    
+    changed holds raw rows as read from SQLite. Existing rows keep their
+    position so views that page through the frame do not reshuffle after an
+    edit; new rows are appended at the end.
+    """
+    key = CACHED_TABLES[table]
+    base = frame.set_index(key)
+    if len(deleted_keys):
+        base = base.drop(index=list(deleted_keys), errors='ignore')
+    if changed is not None:
+        # Rows without a key (vehicles with no VIN) cannot be addressed, so snapshots leave them out
+        changed = changed[changed[key].notna()]
+    if changed is not None and not changed.empty:
+        changed = _apply_dtypes(table, changed, like=frame).set_index(key)[base.columns]
+        for column in base.columns:
+            if isinstance(base[column].dtype, pd.CategoricalDtype):
+                base[column] = base[column].cat.set_categories(changed[column].cat.categories)
+        existing = changed.index.intersection(base.index)
+        if len(existing):
+            base.loc[existing, :] = changed.loc[existing]
+        added = changed.index.difference(base.index)
+        if len(added):
+            base = pd.concat([base, changed.loc[added]])
+    return base.reset_index()[frame.columns]
+
+def frame_memory_usage(frame):
+    """Deep memory usage of a DataFrame in bytes."""
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+class TableSnapshot:
+    """
+    Last loaded copy of one table plus the watermarks needed to refresh it.
+    
+    Rows are fetched again only when they sort after the newest one already
+    seen by (last_updated, rowid), so rows written in the same millisecond
+    are neither missed nor read twice; deletions are replayed from
+    deleted_rows. Rows with a NULL key are not kept, since nothing could
+    address them. The watermarks only move once a delta has been applied.
+    """
+    
+    def __init__(self, table):
+        self.table = table
+        self.key = CACHED_TABLES[table]
+        self.frame = None
+        self.watermark = None  # (last_updated, rowid) of the newest row seen
+        self.tombstone_id = 0
+        self.refreshed_at = 0.0
+    
+    def _needs_full_load(self):
+        if self.frame is None or self.watermark is None:
+            return True
+        return time.time() - self.refreshed_at > TOMBSTONE_RETENTION_DAYS * 86400
+    
+    def _tombstone_keys(self, rows):
+        keys = [row[1] for row in rows]
+        if self.key == 'id':
+            keys = [int(k) for k in keys]
+        return keys
+    
+    def _current_position(self, conn):
+        """Return the (tombstone_id, watermark) of everything committed so far."""
+        tombstone_id = conn.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM deleted_rows"
+        ).fetchone()[0]
+        newest = conn.execute(
+            f"SELECT last_updated, rowid FROM {self.table} ORDER BY last_updated DESC, rowid DESC LIMIT 1"
+        ).fetchone()
+        return tombstone_id, (tuple(newest) if newest else (0, 0))
+    
+    def _advance(self, position):
+        self.tombstone_id, self.watermark = position
+        self.refreshed_at = time.time()
+    
+    def full_load(self, conn):
+        """Rebuild the snapshot from a full table scan."""
+        # Read the position first so no later write can be missed; rows written
+        # in between are read again by the next delta, which is harmless
+        position = self._current_position(conn)
+        raw = pd.read_sql_query(f"SELECT * FROM {self.table}", conn)
+        raw = raw[raw[self.key].notna()].reset_index(drop=True)
+        self.frame = _apply_dtypes(self.table, raw)
+        self._advance(position)
+        return self.frame
+    
+    def apply_changes(self, conn):
+        """
+        Apply rows changed or deleted since the last refresh.
         
-        # Create part_suppliers table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS part_suppliers (
-                id INTEGER PRIMARY KEY,
-                part_id INTEGER,
-                supplier_name TEXT,
-                buying_price REAL,
-                selling_price REAL,
-                delivery_time TEXT,
-                created_date TEXT DEFAULT CURRENT_TIMESTAMP,
-                last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
-                created_by TEXT,
-                last_updated_by TEXT,
-                FOREIGN KEY(part_id) REFERENCES parts(id) ON DELETE CASCADE
-            )
-        ''')
+        Returns (changed, deleted_keys) with the raw changed rows, or None
+        when the snapshot had to be loaded in full.
+        """
+        if self._needs_full_load():
+            self.full_load(conn)
+            return None
         
-        # Create activity_log table for system administration
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS activity_log (
-                id INTEGER PRIMARY KEY,
-                timestamp TEXT,
-                username TEXT,
-                action TEXT,
-                details TEXT,
-                table_name TEXT,
-                record_id TEXT,
-                old_values TEXT,
-                new_values TEXT
-            )
-        ''')
+        changed, deleted_keys, position = self._read_delta(conn, '*')
+        if deleted_keys or not changed.empty:
+            self.frame = _patch_rows(self.table, self.frame, changed, deleted_keys)
+        self._advance(position)
+        return changed, deleted_keys
+    
+    def changed_keys(self, conn):
+        """
+        Return (changed, deleted_keys) since the last call without loading the table.
         
-        # Add indexes
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_vins_client_phone ON vins(client_phone)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_parts_client_phone ON parts(client_phone)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_parts_vin_number ON parts(vin_number)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_part_suppliers_part_id ON part_suppliers(part_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_log_timestamp ON activity_log(timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_log_username ON activity_log(username)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)')
+        Used while the table is not loaded in full: changed holds only the
+        BUNDLE_MATCH_COLUMNS of each changed row. Returns None when there is
+        no usable position to compare against, after recording one.
+        """
+        if self.watermark is None or time.time() - self.refreshed_at > TOMBSTONE_RETENTION_DAYS * 86400:
+            self._advance(self._current_position(conn))
+            return None
+        changed, deleted_keys, position = self._read_delta(
+            conn, ', '.join(BUNDLE_MATCH_COLUMNS[self.table] + ['last_updated'])
+        )
+        self._advance(position)
+        return changed, deleted_keys
+    
+    def _read_delta(self, conn, columns):
+        """
+        Read rows changed and keys deleted since the watermarks.
         
-        # Create default admin user
-        admin_password_hash = hashlib.sha256("admin".encode()).hexdigest()
-        cursor.execute('''
-            INSERT OR IGNORE INTO users (username, password_hash, role) 
-            VALUES (?, ?, ?)
-        ''', ('admin', admin_password_hash, 'admin'))
+        Returns (changed, deleted_keys, position); the snapshot only moves to
+        position once the caller has applied the rest.
+        """
+        tombstones = conn.execute(
+            "SELECT id, row_key FROM deleted_rows WHERE table_name = ? AND id > ? ORDER BY id",
+            (self.table, self.tombstone_id)
+        ).fetchall()
+        changed = pd.read_sql_query(
+            f"SELECT rowid AS delta_rowid, {columns} FROM {self.table} "
+            "WHERE (last_updated, rowid) > (?, ?) ORDER BY last_updated, rowid",
+            conn, params=list(self.watermark)
+        )
         
-        conn.commit()
-    except sqlite3.Error as e:
-        print(f"Error creating tables: {e}")
+        tombstone_id = tombstones[-1][0] if tombstones else self.tombstone_id
+        watermark = self.watermark
+        if not changed.empty:
+            newest = changed.iloc[-1]
+            watermark = (int(newest['last_updated']), int(newest['delta_rowid']))
+        changed = changed.drop(columns='delta_rowid')
+        return changed, self._tombstone_keys(tombstones), (tombstone_id, watermark)
 
-def migrate_schema():
-    """Remove deprecated columns from parts table if they exist"""
-    conn = get_db_connection()
-    if conn is None:
+class SnapshotStore:
+    """Process-wide set of table snapshots shared by every session."""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshots = {table: TableSnapshot(table) for table in CACHED_TABLES}
+    
+    def refresh(self, conn, table):
+        """
+        Bring one snapshot up to date and return its frame.
+        
+        Client bundles holding any of the changed rows are dropped; after a
+        full load it is not known which rows changed, so all of them are.
+        """
+        with self.lock:
+            delta = self.snapshots[table].apply_changes(conn)
+            frame = self.snapshots[table].frame
+        bundles = get_client_bundle_cache()
+        if delta is None:
+            bundles.clear()
+        elif not delta[0].empty or delta[1]:
+            bundles.invalidate(table, *delta)
+        return frame
+    
+    def reset(self, table=None):
+        """Forget one snapshot, or all of them, so the next refresh loads it in full."""
+        with self.lock:
+            if table is None:
+                self.snapshots = {table: TableSnapshot(table) for table in CACHED_TABLES}
+            else:
+                self.snapshots[table] = TableSnapshot(table)
+
+class TableCacheRegistry:
+    """
+    Per-table cache in front of the snapshot loaders.
+    
+    Each table has its own loader and its own entry, so a write only needs to
+    invalidate the tables it touched. Entries stay until they are replaced or
+    invalidated; sync_changes() does that for commits made elsewhere. Hits
+    and misses are counted per table.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaders = {}
+        self.entries = {}
+        self.stats = {}
+        self.derived = {}
+    
+    def register(self, table, loader):
+        """Register loader(conn) as the source of a table's frame."""
+        with self.lock:
+            self.loaders[table] = loader
+            self.entries.pop(table, None)
+            self.stats[table] = {'hits': 0, 'misses': 0}
+    
+    def get(self, table, conn):
+        with self.lock:
+            frame = self.entries.get(table)
+            if frame is not None:
+                self.stats[table]['hits'] += 1
+                return frame
+            self.stats[table]['misses'] += 1
+            loader = self.loaders[table]
+        
+        frame = loader(conn)
+        with self.lock:
+            self.entries[table] = frame
+        return frame
+    
+    def replace(self, table, frame):
+        """Swap in a patched frame for a table that is currently cached."""
+        with self.lock:
+            if table in self.entries:
+                self.entries[table] = frame
+    
+    def invalidate(self, *tables):
+        """Drop the cached entries for the given tables (all tables if none given)."""
+        with self.lock:
+            for table in tables or list(self.entries):
+                self.entries.pop(table, None)
+    
+    def get_derived(self, name, frames, build):
+        """
+        Return build(*frames), reusing the previous result while every frame is
+        the same object it was built from. Cached frames are replaced rather
+        than modified, so object identity doubles as the data version.
+        """
+        with self.lock:
+            cached = self.derived.get(name)
+            if cached is not None and all(a is b for a, b in zip(cached[0], frames)):
+                return cached[1]
+        value = build(*frames)
+        with self.lock:
+            self.derived[name] = (tuple(frames), value)
+        return value
+    
+    def get_stats(self):
+        with self.lock:
+            return {table: dict(counts) for table, counts in self.stats.items()}
+
+class ClientBundleCache:
+    """
+    LRU cache of per-client DataIndex bundles, keyed by client id.
+    
+    Each entry remembers the keys of the rows its bundle holds, so
+    write_through can drop exactly the bundles a written or deleted row
+    belongs to. A bundle loaded while a write was in progress is returned but
+    not kept.
+    """
+    
+    def __init__(self, max_size=CLIENT_BUNDLE_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.bundles = OrderedDict()
+        self.generation = 0
+    
+    def get(self, client_id, load):
+        """Return the bundle for client_id, calling load(client_id) on a miss."""
+        with self.lock:
+            entry = self.bundles.get(client_id)
+            if entry is not None:
+                self.bundles.move_to_end(client_id)
+                return entry[0]
+            generation = self.generation
+        
+        bundle = load(client_id)
+        if bundle is None:
+            return None
+        keys = {}
+        for table, key in CACHED_TABLES.items():
+            frame = getattr(bundle, f'df_{table}')
+            keys[table] = set(frame[key].dropna().tolist()) if key in frame else set()
+        with self.lock:
+            if generation == self.generation:
+                self.bundles[client_id] = (bundle, keys)
+                while len(self.bundles) > self.max_size:
+                    self.bundles.popitem(last=False)
+        return bundle
+    
+    def invalidate(self, table, rows=None, deleted_keys=()):
+        """Drop the bundles holding any of the given rows or belonging to their client."""
+        keys = set(deleted_keys)
+        client_ids = set()
+        part_ids = set()
+        if rows is not None and not rows.empty:
+            keys.update(rows[CACHED_TABLES[table]].tolist())
+            if 'client_id' in rows:
+                client_ids.update(int(client_id) for client_id in rows['client_id'].dropna())
+            if table == 'part_suppliers':
+                part_ids.update(rows['part_id'].tolist())
+        if table == 'clients':
+            client_ids.update(int(client_id) for client_id in keys)
+        
+        with self.lock:
+            self.generation += 1
+            for client_id, (_, bundle_keys) in list(self.bundles.items()):
+                if client_id in client_ids or bundle_keys[table] & keys or bundle_keys['parts'] & part_ids:
+                    del self.bundles[client_id]
+    
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.bundles.clear()
+
+class ChangeMonitor:
+    """
+    Detects commits to the cached tables made since the previous check.
+    
+    PRAGMA data_version on a connection only moves when another connection
+    has committed since that connection last asked, so most checks cost one
+    pragma on the reader they run on. When it has moved, change_counters
+    (bumped by triggers on every insert, update and delete) tells which
+    tables actually changed. This also catches writes from other processes,
+    which the write-through path never sees.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = None
+        self.data_versions = {}
+    
+    def changed_tables(self, conn):
+        """
+        Return the cached tables changed since the last committed check.
+        
+        Callers hold self.lock. Returns (tables, state); pass state to
+        commit() once every table has been applied, so a failed refresh is
+        found again by the next check instead of being forgotten.
+        """
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if self.counters is not None and self.data_versions.get(id(conn)) == data_version:
+            return [], None
+        counters = dict(conn.execute("SELECT table_name, counter FROM change_counters").fetchall())
+        if self.counters is None:
+            # Nothing says what was loaded before the first check, so treat it all as changed
+            changed = list(counters)
+        else:
+            changed = [table for table, counter in counters.items() if counter != self.counters.get(table)]
+        return [table for table in changed if table in CACHED_TABLES], (id(conn), data_version, counters)
+    
+    def commit(self, state):
+        """Record a check returned by changed_tables() as applied."""
+        if state is None:
+            return
+        conn_id, data_version, counters = state
+        self.data_versions[conn_id] = data_version
+        self.counters = counters
+
+@st.cache_resource
+def get_snapshot_store():
+    """Create the snapshot store once per server process."""
+    return SnapshotStore()
+
+@st.cache_resource
+def get_cache_registry():
+    """Create the table cache registry once per server process."""
+    registry = TableCacheRegistry()
+    store = get_snapshot_store()
+    for table in CACHED_TABLES:
+        registry.register(table, lambda conn, table=table: store.refresh(conn, table))
+    return registry
+
+@st.cache_resource
+def get_client_bundle_cache():
+    """Create the client bundle cache once per server process."""
+    return ClientBundleCache()
+
+@st.cache_resource
+def get_change_monitor():
+    """Create the change monitor once per server process."""
+    return ChangeMonitor()
+
+def sync_changes():
+    """
+    Bring the shared caches up to date with commits made since the last check.
+    
+    Runs at the start of every script run. When nothing was committed it
+    costs one pragma; otherwise only the tables that changed are patched, and
+    only the client bundles holding changed rows are dropped, so every
+    session sees fresh data without reloading anything else.
+    
+    Returns:
+        List of the tables that had changed
+    """
+    monitor = get_change_monitor()
+    store = get_snapshot_store()
+    try:
+        # Take the lock before a reader so a waiting session never holds one
+        with monitor.lock, read_connection() as conn:
+            tables, state = monitor.changed_tables(conn)
+            failed = []
+            for table in tables:
+                try:
+                    _sync_table(conn, table)
+                except Exception as e:
+                    # Drop what this table had cached so the next run rebuilds it
+                    # rather than serving rows that missed the change
+                    print(f"Error applying changes to {table}: {e}")
+                    store.reset(table)
+                    invalidate_tables(table)
+                    failed.append(table)
+            if not failed:
+                monitor.commit(state)
+        return tables
+    except Exception as e:
+        print(f"Error checking for changes: {e}")
+        return []
+
+def _sync_table(conn, table):
+    """Apply the latest changes of one table to its snapshot or to the client bundles."""
+    store = get_snapshot_store()
+    if store.snapshots[table].frame is not None:
+        get_cache_registry().replace(table, store.refresh(conn, table))
         return
+    # Not loaded in full, so only bundles can hold its rows; read
+    # just enough of the delta to find the ones that do
+    with store.lock:
+        delta = store.snapshots[table].changed_keys(conn)
+    bundles = get_client_bundle_cache()
+    if delta is None:
+        bundles.clear()
+    elif not delta[0].empty or delta[1]:
+        bundles.invalidate(table, *delta)
+
+def invalidate_tables(*tables):
+    """Mark cached tables as stale after a write; with no arguments, all of them."""
+    get_cache_registry().invalidate(*tables)
+    get_client_bundle_cache().clear()
+
+def write_through(table, rows=None, deleted_keys=()):
+    """
+    Apply rows just written by a mutation to the cached frames.
+    
+    rows is a DataFrame of full table rows (as returned by RETURNING *) that
+    are upserted by primary key; deleted_keys are removed together with any
+    child rows that ON DELETE CASCADE removed from the database.
+    """
+    store = get_snapshot_store()
+    registry = get_cache_registry()
+    bundles = get_client_bundle_cache()
+    with store.lock:
+        pending = [(table, rows, list(deleted_keys))]
+        while pending:
+            name, changed, keys = pending.pop()
+            bundles.invalidate(name, changed, keys)
+            # Children are followed even when the parent itself is not cached
+            for child, fk in CASCADES.get(name, []) if keys else []:
+                child_frame = store.snapshots[child].frame
+                if child_frame is not None:
+                    child_key = CACHED_TABLES[child]
+                    orphans = child_frame.loc[child_frame[fk].isin(keys), child_key].tolist()
+                    if orphans:
+                        pending.append((child, None, orphans))
+            snap = store.snapshots[name]
+            if snap.frame is None:
+                continue
+            snap.frame = _patch_rows(name, snap.frame, changed, keys)
+            registry.replace(name, snap.frame)
+
+def get_group_index(table, column, frame):
+    """Return the shared GroupIndex for a cached table, built once per data version."""
+    return get_cache_registry().get_derived(
+        ('group_index', table, column), (frame,), lambda df: GroupIndex(df, column)
+    )
+
+def load_table(table):
+    """Load a single cached table through the registry."""
     try:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(parts)")
-        columns = [col[1] for col in cursor.fetchall()]
-        
-        if 'deposit' in columns:
-            cursor.execute("ALTER TABLE parts DROP COLUMN deposit;")
-        if 'balance' in columns:
-            cursor.execute("ALTER TABLE parts DROP COLUMN balance;")
-        conn.commit()
-    except sqlite3.Error as e:
-        print(f"Migration error: {e}")
+        with read_connection() as conn:
+            return get_cache_registry().get(table, conn)
+    except Exception as e:
+        print(f"Error loading {table}: {e}")
+        return pd.DataFrame()
+
+def _load_scoped(label, queries, value):
+    """
+    Run one query per table, each taking value as its only parameter.
+    
+    Args:
+        label: What is being loaded, for the error message
+        queries: Dict mapping clients, vins, parts and part_suppliers, in that order, to a SELECT
+        value: The id, VIN or part id the queries filter on
+    
+    Returns:
+        (clients, vins, parts, part_suppliers) frames with the table dtypes
+    """
+    try:
+        with read_connection() as conn:
+            return tuple(
+                _apply_dtypes(table, pd.read_sql_query(query, conn, params=[value]))
+                for table, query in queries.items()
+            )
+    except Exception as e:
+        print(f"Error loading {label} data: {e}")
+        return tuple(pd.DataFrame() for _ in queries)
+
+def load_client_data(client_id):
+    """
+    Load one client's rows straight from the database.
+    
+    Returns (clients, vins, parts, part_suppliers) frames holding only rows
+    that belong to the client, using the client_id indexes.
+    """
+    return _load_scoped('client', {
+        'clients': "SELECT * FROM clients WHERE id = ?",
+        'vins': "SELECT * FROM vins WHERE client_id = ?",
+        'parts': "SELECT * FROM parts WHERE client_id = ?",
+        'part_suppliers': "SELECT ps.* FROM part_suppliers ps JOIN parts p ON p.id = ps.part_id WHERE p.client_id = ?",
+    }, client_id)
+
+def load_vin_data(vin_number):
+    """
+    Load one VIN's rows straight from the database.
+    
+    Returns (clients, vins, parts, part_suppliers) frames holding the VIN,
+    its client, its parts and their suppliers.
+    """
+    return _load_scoped('VIN', {
+        'clients': "SELECT c.* FROM clients c JOIN vins v ON v.client_id = c.id WHERE v.vin_number = ?",
+        'vins': "SELECT * FROM vins WHERE vin_number = ?",
+        'parts': "SELECT * FROM parts WHERE vin_number = ?",
+        'part_suppliers': "SELECT ps.* FROM part_suppliers ps JOIN parts p ON p.id = ps.part_id WHERE p.vin_number = ?",
+    }, vin_number)
+
+def load_part_data(part_id):
+    """
+    Load one part's rows straight from the database.
+    
+    Returns (clients, vins, parts, part_suppliers) frames holding the part,
+    its suppliers and the VIN and client it belongs to, if any.
+    """
+    return _load_scoped('part', {
+        'clients': "SELECT c.* FROM clients c JOIN parts p ON p.client_id = c.id WHERE p.id = ?",
+        'vins': "SELECT v.* FROM vins v JOIN parts p ON p.vin_number = v.vin_number WHERE p.id = ?",
+        'parts': "SELECT * FROM parts WHERE id = ?",
+        'part_suppliers': "SELECT * FROM part_suppliers WHERE part_id = ?",
+    }, part_id)
+
+class RequestContext:
+    """
+    Data used by a single script run.
+    
+    Creating it first picks up commits made since the previous run (see
+    sync_changes). Nothing is loaded up front: each cached table is fetched
+    the first time a view reads it, and per-client, per-VIN and per-part
+    data is queried only for the ids a view asks for. Whatever is loaded is
+    reused for the rest of the run.
+    
+    tables, client_ids, vin_numbers and part_ids name the data the current
+    view declared it needs; they are fetched immediately so the view renders
+    in one pass. client_loader(client_id) returns the DataIndex for one
+    client and defaults to querying load_client_data.
+    """
+    
+    def __init__(self, tables=(), client_ids=(), client_loader=None, vin_numbers=(), part_ids=()):
+        sync_changes()
+        self._tables = {}
+        self._clients = {}
+        self._vins = {}
+        self._parts = {}
+        self.client_loader = client_loader or (lambda client_id: DataIndex.from_frames(*load_client_data(client_id)))
+        self.index = DataIndex(self.table, get_group_index)
+        for table in tables:
+            self.table(table)
+        for client_id in client_ids:
+            if client_id is not None:
+                self.for_client(client_id)
+        for vin_number in vin_numbers:
+            if vin_number:
+                self.for_vin(vin_number)
+        for part_id in part_ids:
+            if part_id is not None:
+                self.for_part(part_id)
+    
+    def table(self, name):
+        """Return a full cached table, loading it on first use."""
+        if name not in self._tables:
+            self._tables[name] = load_table(name)
+        return self._tables[name]
+    
+    @property
+    def df_clients(self):
+        return self.table('clients')
+    
+    @property
+    def df_vins(self):
+        return self.table('vins')
+    
+    @property
+    def df_parts(self):
+        return self.table('parts')
+    
+    @property
+    def df_part_suppliers(self):
+        return self.table('part_suppliers')
+    
+    def for_client(self, client_id):
+        """Return a DataIndex over one client's rows, queried on first use."""
+        client_id = int(client_id)
+        if client_id not in self._clients:
+            self._clients[client_id] = self.client_loader(client_id)
+        return self._clients[client_id]
+    
+    def for_vin(self, vin_number):
+        """Return a DataIndex over one VIN, its parts and their suppliers, queried on first use."""
+        if vin_number not in self._vins:
+            self._vins[vin_number] = DataIndex.from_frames(*load_vin_data(vin_number))
+        return self._vins[vin_number]
+    
+    def for_part(self, part_id):
+        """Return a DataIndex over one part and its suppliers, queried on first use."""
+        part_id = int(part_id)
+        if part_id not in self._parts:
+            self._parts[part_id] = DataIndex.from_frames(*load_part_data(part_id))
+        return self._parts[part_id]
+
+def get_cache_stats():
+    """Return cache hit/miss counts, row counts and memory use per table as a DataFrame."""
+    stats = get_cache_registry().get_stats()
+    store = get_snapshot_store()
+    rows = []
+    for table, counts in stats.items():
+        frame = store.snapshots[table].frame
+        rows.append({
+            'table': table,
+            'hits': counts['hits'],
+            'misses': counts['misses'],
+            'rows': len(frame) if frame is not None else 0,
+            'memory_kb': round(frame_memory_usage(frame) / 1024, 1) if frame is not None else 0.0,
+        })
+    return pd.DataFrame(rows)
 
-@st.cache_data(ttl=300, show_spinner="Loading data...")
 def load_data():
-    """Loads all data from the database into pandas DataFrames."""
-    conn = get_db_connection()
-    if conn is None:
-        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-        
+    """
+    Loads all data from the database into pandas DataFrames.
+    
+    The frames are kept between calls and only patched with rows that
+    changed since the previous call, so they must be treated as read-only.
+    """
     try:
-        df_clients = pd.read_sql_query("SELECT * FROM clients", conn)
-        df_vins = pd.read_sql_query("SELECT * FROM vins", conn)
-        df_parts = pd.read_sql_query("SELECT * FROM parts", conn)
-        df_part_suppliers = pd.read_sql_query("SELECT * FROM part_suppliers", conn)
+        sync_changes()
+        registry = get_cache_registry()
+        with read_connection() as conn:
+            df_clients = registry.get('clients', conn)
+            df_vins = registry.get('vins', conn)
+            df_parts = registry.get('parts', conn)
+            df_part_suppliers = registry.get('part_suppliers', conn)
         return df_clients, df_vins, df_parts, df_part_suppliers
     except Exception as e:
         print(f"Error loading data: {e}")
@@ -189,43 +1486,48 @@ def load_data():
 
 def export_filtered_data(filters=None, format_type='csv'):
     """Export filtered data based on provided filters"""
-    conn = get_db_connection()
-    if conn is None:
-        return io.BytesIO(), 'application/zip'
-    
+    # Rows are matched to the client through its id, found by the normalized
+    # phone so the filter matches however the number was typed
+    client_id = "(SELECT id FROM clients WHERE phone_key = ?)"
+    phone_key = normalize_phone(filters['client_phone']) if filters and 'client_phone' in filters else None
     queries = {}
     if not filters or 'clients' in filters.get('include', ['clients', 'vins', 'parts', 'part_suppliers']):
-        client_where = ""
+        client_where, client_params = "", []
         if filters and 'client_phone' in filters:
-            client_where = f"WHERE phone = '{filters['client_phone']}'"
-        queries['clients'] = f"SELECT * FROM clients {client_where}"
+            client_where, client_params = f"WHERE id = {client_id}", [phone_key]
+        queries['clients'] = (f"SELECT * FROM clients {client_where}", client_params)
     
     if not filters or 'vins' in filters.get('include', ['clients', 'vins', 'parts', 'part_suppliers']):
-        vin_where = ""
+        vin_where, vin_params = "", []
         if filters and 'client_phone' in filters:
-            vin_where = f"WHERE client_phone = '{filters['client_phone']}'"
+            vin_where, vin_params = f"WHERE client_id = {client_id}", [phone_key]
         if filters and 'vin_number' in filters:
             connector = "AND" if vin_where else "WHERE"
-            vin_where += f" {connector} vin_number = '{filters['vin_number']}'"
-        queries['vins'] = f"SELECT * FROM vins {vin_where}"
+            vin_where += f" {connector} vin_number = ?"
+            vin_params.append(filters['vin_number'])
+        queries['vins'] = (f"SELECT * FROM vins {vin_where}", vin_params)
     
     if not filters or 'parts' in filters.get('include', ['clients', 'vins', 'parts', 'part_suppliers']):
-        part_where = ""
+        part_where, part_params = "", []
         if filters and 'client_phone' in filters:
-            part_where = f"WHERE client_phone = '{filters['client_phone']}'"
+            part_where, part_params = f"WHERE client_id = {client_id}", [phone_key]
         if filters and 'vin_number' in filters:
             connector = "AND" if part_where else "WHERE"
-            part_where += f" {connector} vin_number = '{filters['vin_number']}'"
-        queries['parts'] = f"SELECT * FROM parts {part_where}"
+            part_where += f" {connector} vin_number = ?"
+            part_params.append(filters['vin_number'])
+        queries['parts'] = (f"SELECT * FROM parts {part_where}", part_params)
     
     if not filters or 'part_suppliers' in filters.get('include', ['clients', 'vins', 'parts', 'part_suppliers']):
-        supplier_where = ""
-        queries['part_suppliers'] = f"SELECT * FROM part_suppliers {supplier_where}"
+        queries['part_suppliers'] = ("SELECT * FROM part_suppliers", [])
     
     data = {}
     try:
-        for name, query in queries.items():
-            data[name] = pd.read_sql_query(query, conn)
+        with read_connection() as conn:
+            for name, (query, params) in queries.items():
+                data[name] = pd.read_sql_query(query, conn, params=params)
+                # Exports are for people, so show local times rather than epoch milliseconds
+                for column in TIMESTAMP_COLUMNS.get(name, {}):
+                    data[name][column] = epoch_ms_to_datetime(data[name][column])
     except Exception as e:
         print(f"Error exporting filtered data: {e}")
         return io.BytesIO(), 'application/zip'
@@ -248,36 +1550,68 @@ def export_filtered_data(filters=None, format_type='csv'):
         zip_buffer.seek(0)
         return zip_buffer, 'application/zip'
 
-def get_activity_logs(username=None, limit=100):
-    """Get activity logs (admin only)"""
-    conn = get_db_connection()
-    if conn is None:
-        return pd.DataFrame()
+def get_activity_logs(username=None, limit=100, action=None, start_ms=None, end_ms=None):
+    """
+    Get activity logs (admin only), newest first
+    
+    Args:
+        username: Only entries by this user
+        limit: Maximum number of entries
+        action: Only entries with this action
+        start_ms: Only entries at or after this epoch millisecond
+        end_ms: Only entries before this epoch millisecond
     
+    Returns:
+        DataFrame of log entries with timestamp as local datetimes
+    """
     try:
-        query = "SELECT * FROM activity_log"
+        clauses = []
         params = []
+        # Equality filters first, then the range: each pair matches an
+        # (username|action, timestamp) index
         if username:
-            query += " WHERE username = ?"
+            clauses.append("username = ?")
             params.append(username)
-        query += " ORDER BY timestamp DESC LIMIT ?"
+        if action:
+            clauses.append("action = ?")
+            params.append(action)
+        if start_ms is not None:
+            clauses.append("timestamp >= ?")
+            params.append(int(start_ms))
+        if end_ms is not None:
+            clauses.append("timestamp < ?")
+            params.append(int(end_ms))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f"SELECT * FROM activity_log {where} ORDER BY timestamp DESC LIMIT ?"
         params.append(limit)
         
-        return pd.read_sql_query(query, conn, params=params)
+        with read_connection() as conn:
+            logs = pd.read_sql_query(query, conn, params=params)
+        logs['timestamp'] = epoch_ms_to_datetime(logs['timestamp'])
+        return logs
     except Exception as e:
         print(f"Error getting activity logs: {e}")
         return pd.DataFrame()
 
 def database_maintenance():
     """Perform database maintenance tasks"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
-    try:
+    def maintain(conn):
+        conn.execute(
+            "DELETE FROM deleted_rows WHERE deleted_at < ?",
+            (now_ms() - TOMBSTONE_RETENTION_DAYS * 86400000,)
+        )
+        # VACUUM cannot run inside a transaction
+        conn.commit()
         conn.execute("VACUUM")
+        # VACUUM may renumber the rowids the search tables are keyed on
+        for fts, *_ in _search_tables():
+            conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        conn.commit()
         conn.execute("ANALYZE")
-        
-        result = conn.execute("PRAGMA integrity_check").fetchone()
+        return conn.execute("PRAGMA integrity_check").fetchone()
+    
+    try:
+        result = run_write(maintain)
         return result[0] == "ok"
     except Exception as e:
         print(f"Database maintenance error: {e}")
@@ -287,22 +1621,19 @@ def export_database_backup():
     """Export database to a backup file with timestamp"""
     backup_filename = f"backups/db_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
     
-    conn = get_db_connection()
-    if conn is None:
-        return None
-    
     try:
         # Get all data from all tables
         tables = ['clients', 'vins', 'parts', 'part_suppliers', 'users', 'activity_log']
         backup_data = {}
         
-        for table in tables:
-            try:
-                df = pd.read_sql_query(f"SELECT * FROM {table}", conn)
-                backup_data[table] = df.to_dict('records')
-            except:
-                # Table might not exist, skip it
-                continue
+        with read_connection() as conn:
+            for table in tables:
+                try:
+                    df = pd.read_sql_query(f"SELECT * FROM {table}", conn)
+                    backup_data[table] = df.to_dict('records')
+                except:
+                    # Table might not exist, skip it
+                    continue
         
         # Create backups directory if it doesn't exist
         os.makedirs('backups', exist_ok=True)
@@ -315,8 +1646,6 @@ def export_database_backup():
     except Exception as e:
         print(f"Backup error: {e}")
         return None
-    finally:
-        conn.close()
 
 def import_database_backup(backup_file):
     """Import database from backup file"""
@@ -324,31 +1653,46 @@ def import_database_backup(backup_file):
         with open(backup_file, 'r') as f:
             backup_data = json.load(f)
         
-        conn = get_db_connection()
-        if conn is None:
-            return False
-        
-        cursor = conn.cursor()
-        
-        # Restore data to tables
-        for table, records in backup_data.items():
-            if records:
-                # Clear existing data
-                cursor.execute(f"DELETE FROM {table}")
-                
-                # Insert backed up data
-                for record in records:
-                    columns = ', '.join(record.keys())
-                    placeholders = ', '.join(['?' for _ in record])
-                    values = list(record.values())
+        def restore(conn):
+            cursor = conn.cursor()
+            
+            # Restore data to tables
+            for table, records in backup_data.items():
+                if records:
+                    # Clear existing data
+                    cursor.execute(f"DELETE FROM {table}")
                     
-                    cursor.execute(
-                        f"INSERT INTO {table} ({columns}) VALUES ({placeholders})",
-                        values
-                    )
+                    # Insert backed up data
+                    for record in records:
+                        if 'client_phone' in record:
+                            # Backups from before client ids point at clients by phone;
+                            # clients come first in a backup, so the ids exist by now
+                            client = cursor.execute(
+                                "SELECT id FROM clients WHERE phone = ?", (record.pop('client_phone'),)
+                            ).fetchone()
+                            record['client_id'] = client[0] if client else None
+                        if table in LOOKUP_KEYS:
+                            # Backups taken before the key columns existed do not
+                            # carry them; filling them in here rather than by a
+                            # later UPDATE keeps the rows' last_updated and version
+                            key_column, source_column, normalize = LOOKUP_KEYS[table]
+                            if record.get(key_column) is None and record.get(source_column) is not None:
+                                record[key_column] = normalize(record[source_column]) or None
+                        columns = ', '.join(record.keys())
+                        placeholders = ', '.join(['?' for _ in record])
+                        values = list(record.values())
+                        
+                        cursor.execute(
+                            f"INSERT INTO {table} ({columns}) VALUES ({placeholders})",
+                            values
+                        )
+            # Older backups hold text timestamps
+            backfill_epoch_timestamps(conn)
         
-        conn.commit()
-        conn.close()
+        run_write(restore)
+        # Restored rows keep their original timestamps, so deltas would miss them
+        get_snapshot_store().reset()
+        invalidate_tables()
         return True
         
     except Exception as e:
@@ -1,23 +1,64 @@
 # logic.py
 import sqlite3
-from datetime import datetime
+import re
+import json
+import base64
+import binascii
 import pandas as pd
-from security import validate_phone, validate_vin, sanitize_input, validate_numeric
-from db_utils import log_activity, get_db_connection
+from security import validate_phone, validate_vin, sanitize_input, validate_numeric, normalize_phone, normalize_vin
+from db_utils import _apply_dtypes, read_connection, run_write, write_through, get_client_bundle_cache, now_ms, CACHED_TABLES, SEARCH_COLUMNS, FRAGMENT_COLUMNS, LOOKUP_KEYS, TOUCH_SQL
+from data_utils import DataIndex
+from auth import log_activity
+
+def _fetch_returning(cursor):
+    """Collect the rows produced by a RETURNING clause as a DataFrame."""
+    rows = cursor.fetchall()
+    return pd.DataFrame(rows, columns=[col[0] for col in cursor.description])
+
+def _returned_row(rows):
+    """First RETURNING row as a dict of plain Python values, ready for the activity log."""
+    return rows.astype(object).where(rows.notna(), None).iloc[0].to_dict()
+
+def _constraint_error(error, messages):
+    """
+    Map an IntegrityError to a ValueError by the constraint it reports.
+    
+    messages maps a fragment of SQLite's error text (a column such as
+    'clients.phone' or 'FOREIGN KEY') to the message to raise. Errors that
+    match none of them are returned unchanged.
+    """
+    for constraint, message in messages.items():
+        if constraint in str(error):
+            return ValueError(message)
+    return error
 
 def _execute_query(query, params=(), fetch=None):
-    """A helper function to execute database queries with a cached connection."""
-    conn = get_db_connection()
-    if conn is None:
-        raise ConnectionError("Database connection not available")
+    """
+    A helper function to execute database queries.
     
-    try:
+    SELECTs run on a pooled reader connection; anything else is queued to
+    the single writer connection and committed there.
+    """
+    if query.strip().upper().startswith('SELECT'):
+        try:
+            with read_connection() as conn:
+                cursor = conn.execute(query, params)
+                if fetch == 'one':
+                    return cursor.fetchone()
+                elif fetch == 'all':
+                    return cursor.fetchall()
+                return None
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            raise
+    
+    def execute(conn):
         cursor = conn.cursor()
         cursor.execute(query, params)
         
-        if not query.strip().upper().startswith('SELECT'):
-            conn.commit()
-            
+        if fetch == 'returning':
+            # RETURNING rows have to be read before the statement is committed
+            return _fetch_returning(cursor)
         if fetch == 'one':
             return cursor.fetchone()
         elif fetch == 'all':
@@ -26,16 +67,15 @@ def _execute_query(query, params=(), fetch=None):
             return cursor.lastrowid
         else:
             return None
+    
+    try:
+        return run_write(execute)
     except sqlite3.Error as e:
         print(f"Database error: {e}")
-        conn.rollback()
         raise
-    finally:
-        # Don't close the connection as it's cached and managed by Streamlit
-        pass
 
 def add_new_client(phone, client_name, username):
-    """Add a new client to the database with validation"""
+    """Add a new client to the database with validation and return its client id"""
     if not phone:
         raise ValueError("Phone number is required")
     
@@ -45,31 +85,26 @@ def add_new_client(phone, client_name, username):
     phone = sanitize_input(phone)
     client_name = sanitize_input(client_name)
     
-    existing_client = _execute_query(
-        "SELECT phone FROM clients WHERE phone = ?", 
-        (phone,), 
-        fetch='one'
+    # Conflicts on phone or phone_key insert nothing, so no row comes back
+    rows = _execute_query(
+        "INSERT INTO clients (phone, phone_key, client_name, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?) ON CONFLICT DO NOTHING RETURNING *", 
+        (phone, normalize_phone(phone) or None, client_name, username, username),
+        fetch='returning'
     )
     
-    if existing_client:
+    if rows.empty:
         raise ValueError(f"Client with phone {phone} already exists")
-    
-    result = _execute_query(
-        "INSERT INTO clients (phone, client_name, created_by, last_updated_by) VALUES (?, ?, ?, ?)", 
-        (phone, client_name, username, username)
-    )
+    client_id = int(rows['id'].iloc[0])
+    write_through('clients', rows)
     
     log_activity(username, "add_client", f"Added client: {phone} - {client_name}", 
-                "clients", phone, None, {"phone": phone, "client_name": client_name})
-    return result
+                "clients", client_id, None, {"phone": phone, "client_name": client_name})
+    return client_id
 
-def add_vin_to_client(client_phone, vin_no, model, prod_yr, body, engine, code, transmission, username):
+def add_vin_to_client(client_id, vin_no, model, prod_yr, body, engine, code, transmission, username):
     """Add a VIN to a client with validation"""
-    if not client_phone:
-        raise ValueError("Client phone is required")
-    
-    if not validate_phone(client_phone):
-        raise ValueError("Invalid client phone format")
+    if client_id is None:
+        raise ValueError("Client ID is required")
     
     if vin_no:
         clean_vin = ''.join(vin_no.split()).upper()
@@ -78,7 +113,7 @@ def add_vin_to_client(client_phone, vin_no, model, prod_yr, body, engine, code,
     else:
         clean_vin = None
     
-    client_phone = sanitize_input(client_phone)
+    client_id = int(client_id)
     clean_vin = sanitize_input(clean_vin) if clean_vin else None
     model = sanitize_input(model)
     prod_yr = sanitize_input(prod_yr)
@@ -87,23 +122,30 @@ def add_vin_to_client(client_phone, vin_no, model, prod_yr, body, engine, code,
     code = sanitize_input(code)
     transmission = sanitize_input(transmission)
     
-    client_exists = _execute_query(
-        "SELECT phone FROM clients WHERE phone = ?", 
-        (client_phone,), 
-        fetch='one'
-    )
-    
-    if not client_exists:
-        raise ValueError(f"Client with phone {client_phone} does not exist")
-    
-    result = _execute_query(
-        "INSERT OR IGNORE INTO vins (vin_number, client_phone, model, prod_yr, body, engine, code, transmission, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (clean_vin, client_phone, model, prod_yr, body, engine, code, transmission, username, username)
-    )
-    
-    log_activity(username, "add_vin", f"Added VIN: {clean_vin} for client: {client_phone}", 
-                "vins", clean_vin, None, {"vin_number": clean_vin, "client_phone": client_phone})
-    return result
+    # The INSERT only selects a row when the client exists. Nothing comes
+    # back when the client is missing or the VIN is already registered.
+    try:
+        rows = _execute_query(
+            """INSERT INTO vins (vin_number, vin_key, client_id, model, prod_yr, body, engine, code, transmission, created_by, last_updated_by)
+               SELECT ?, ?, id, ?, ?, ?, ?, ?, ?, ?, ? FROM clients WHERE id = ?
+               ON CONFLICT(vin_number) DO NOTHING
+               RETURNING *""",
+            (clean_vin, normalize_vin(clean_vin) or None, model, prod_yr, body, engine, code, transmission, username, username,
+             client_id),
+            fetch='returning'
+        )
+    except sqlite3.IntegrityError as e:
+        raise _constraint_error(e, {'vins.vin_key': f"VIN {clean_vin} is already registered"}) from e
+    
+    if rows.empty:
+        if not _execute_query("SELECT 1 FROM clients WHERE id = ?", (client_id,), fetch='one'):
+            raise ValueError(f"Client {client_id} does not exist")
+        raise ValueError(f"VIN {clean_vin} is already registered")
+    write_through('vins', rows)
+    
+    log_activity(username, "add_vin", f"Added VIN: {clean_vin} for client: {client_id}", 
+                "vins", clean_vin, None, {"vin_number": clean_vin, "client_id": client_id})
+    return clean_vin
 
 def add_supplier_to_part(part_id, supplier_name, buying_price, selling_price, delivery_time, username):
     """Add a supplier to a part with validation"""
@@ -125,56 +167,65 @@ def add_supplier_to_part(part_id, supplier_name, buying_price, selling_price, de
     if not validate_numeric(selling_price, min_val=0):
         raise ValueError("Invalid selling price")
     
-    result = _execute_query(
-        "INSERT INTO part_suppliers (part_id, supplier_name, buying_price, selling_price, delivery_time, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (part_id, supplier_name, buying_price, selling_price, delivery_time, username, username)
-    )
+    try:
+        rows = _execute_query(
+            "INSERT INTO part_suppliers (part_id, supplier_name, buying_price, selling_price, delivery_time, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING *",
+            (part_id, supplier_name, buying_price, selling_price, delivery_time, username, username),
+            fetch='returning'
+        )
+    except sqlite3.IntegrityError as e:
+        raise _constraint_error(e, {'FOREIGN KEY': f"Part {part_id} does not exist"}) from e
+    write_through('part_suppliers', rows)
     
     log_activity(username, "add_supplier", f"Added supplier: {supplier_name} for part: {part_id}", 
                 "part_suppliers", part_id, None, {"part_id": part_id, "supplier_name": supplier_name})
-    return result
+    return int(rows['id'].iloc[0])
 
-def add_part_to_vin(vin_number, client_phone, part_name, part_number, quantity, notes, suppliers, username):
-    """Add a part to a VIN with transaction handling using a cached connection."""
+def add_part_to_vin(vin_number, client_id, part_name, part_number, quantity, notes, suppliers, username):
+    """Add a part to a VIN with transaction handling on the writer connection."""
     if not part_name and not part_number:
         raise ValueError("Part name or part number is required")
     
-    date_added = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    date_added = now_ms()
     
-    conn = get_db_connection()
-    if conn is None:
-        raise ConnectionError("Database connection not available")
-        
-    try:
+    def insert(conn):
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO parts (vin_number, client_phone, part_name, part_number, quantity, notes, date_added, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (vin_number, client_phone, part_name, part_number, quantity, notes, date_added, username, username)
+            "INSERT INTO parts (vin_number, client_id, part_name, part_number, quantity, notes, date_added, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING *",
+            (vin_number, client_id, part_name, part_number, quantity, notes, date_added, username, username)
         )
-        part_id = cursor.lastrowid
+        part_rows = _fetch_returning(cursor)
+        part_id = int(part_rows['id'].iloc[0])
         
+        supplier_rows = []
         for supplier in suppliers:
             cursor.execute(
-                "INSERT INTO part_suppliers (part_id, supplier_name, buying_price, selling_price, delivery_time, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                "INSERT INTO part_suppliers (part_id, supplier_name, buying_price, selling_price, delivery_time, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING *",
                 (part_id, supplier['name'], supplier['buying_price'], supplier['selling_price'], supplier['delivery_time'], username, username)
             )
-        conn.commit()
+            supplier_rows.append(_fetch_returning(cursor))
+        return part_id, part_rows, supplier_rows
+    
+    try:
+        part_id, part_rows, supplier_rows = run_write(insert)
+        write_through('parts', part_rows)
+        if supplier_rows:
+            write_through('part_suppliers', pd.concat(supplier_rows, ignore_index=True))
         
         log_activity(username, "add_part", f"Added part: {part_name} ({part_number}) to VIN: {vin_number}", 
                     "parts", part_id, None, {"part_name": part_name, "part_number": part_number})
         return part_id
     except sqlite3.Error as e:
-        conn.rollback()
         print(f"Database error during part/supplier addition: {e}")
         raise
 
-def safe_add_part_to_vin(vin_number, client_phone, part_data, suppliers, username):
+def safe_add_part_to_vin(vin_number, client_id, part_data, suppliers, username):
     """
     Safely add a part to a VIN with comprehensive error handling
     
     Args:
         vin_number: VIN to add part to
-        client_phone: Client phone number
+        client_id: ID of the client owning the VIN
         part_data: Dictionary with part details
         suppliers: List of supplier dictionaries
         username: Username of the user adding the part
@@ -191,7 +242,7 @@ def safe_add_part_to_vin(vin_number, client_phone, part_data, suppliers, usernam
         
         return add_part_to_vin(
             vin_number,
-            client_phone,
+            client_id,
             part_data['name'],
             part_data['number'],
             part_data['quantity'],
@@ -203,177 +254,492 @@ def safe_add_part_to_vin(vin_number, client_phone, part_data, suppliers, usernam
         print(f"Error adding part to VIN: {e}")
         raise
 
-def add_part_without_vin(part_name, part_number, quantity, notes, client_phone, suppliers, username):
-    """Add a part without a VIN with transaction handling using a cached connection."""
+def add_part_without_vin(part_name, part_number, quantity, notes, client_id, suppliers, username):
+    """Add a part without a VIN with transaction handling on the writer connection."""
     if not part_name and not part_number:
         raise ValueError("Part name or part number is required")
     
-    date_added = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    date_added = now_ms()
 
-    conn = get_db_connection()
-    if conn is None:
-        raise ConnectionError("Database connection not available")
-        
-    try:
+    def insert(conn):
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO parts (part_name, part_number, quantity, notes, date_added, client_phone, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (part_name, part_number, quantity, notes, date_added, client_phone, username, username)
+            "INSERT INTO parts (part_name, part_number, quantity, notes, date_added, client_id, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?) RETURNING *",
+            (part_name, part_number, quantity, notes, date_added, client_id, username, username)
         )
-        part_id = cursor.lastrowid
+        part_rows = _fetch_returning(cursor)
+        part_id = int(part_rows['id'].iloc[0])
         
+        supplier_rows = []
         for supplier in suppliers:
             cursor.execute(
-                "INSERT INTO part_suppliers (part_id, supplier_name, buying_price, selling_price, delivery_time, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                "INSERT INTO part_suppliers (part_id, supplier_name, buying_price, selling_price, delivery_time, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING *",
                 (part_id, supplier['name'], supplier['buying_price'], supplier['selling_price'], supplier['delivery_time'], username, username)
             )
-        conn.commit()
+            supplier_rows.append(_fetch_returning(cursor))
+        return part_id, part_rows, supplier_rows
+    
+    try:
+        part_id, part_rows, supplier_rows = run_write(insert)
+        write_through('parts', part_rows)
+        if supplier_rows:
+            write_through('part_suppliers', pd.concat(supplier_rows, ignore_index=True))
         
-        log_activity(username, "add_part", f"Added part without VIN: {part_name} ({part_number}) for client: {client_phone}", 
+        log_activity(username, "add_part", f"Added part without VIN: {part_name} ({part_number}) for client: {client_id}", 
                     "parts", part_id, None, {"part_name": part_name, "part_number": part_number})
         return part_id
     except sqlite3.Error as e:
-        conn.rollback()
         print(f"Database error during part/supplier addition: {e}")
         raise
 
-def delete_client(phone, username):
-    """Delete a client and all associated data"""
-    if not phone:
-        raise ValueError("Phone number is required")
+def add_parts_bulk(parts, username, vin_number=None, client_id=None):
+    """
+    Add several parts and their suppliers in a single transaction
     
-    client_name = _execute_query(
-        "SELECT client_name FROM clients WHERE phone = ?", 
-        (phone,), 
-        fetch='one'
-    )
+    Args:
+        parts: List of part dictionaries (name, number, quantity, notes and an
+            optional list of supplier dictionaries under 'suppliers')
+        username: Username of the user adding the parts
+        vin_number: VIN to add the parts to, if any
+        client_id: ID of the client owning the parts; taken from the VIN when omitted
+    
+    Returns:
+        List of new part ids, in the same order as parts
+    """
+    errors = []
+    for idx, part in enumerate(parts):
+        if not part.get('name') and not part.get('number'):
+            errors.append(f"Part {idx+1}: Name or Number is required")
+        if not validate_numeric(part.get('quantity', 0), min_val=1):
+            errors.append(f"Part {idx+1}: Quantity must be at least 1")
+    if errors:
+        raise ValueError("; ".join(errors))
+    if not parts:
+        return []
+    
+    # Ids read from frames arrive as numpy or pandas scalars
+    client_id = None if client_id is None or pd.isna(client_id) else int(client_id)
+    if vin_number and client_id is None:
+        vin = _execute_query("SELECT client_id FROM vins WHERE vin_number = ?", (vin_number,), fetch='one')
+        if vin is None:
+            raise ValueError(f"VIN {vin_number} not found in database")
+        client_id = vin[0]
+    
+    date_added = now_ms()
+    
+    def insert(conn):
+        cursor = conn.cursor()
+        # executemany cannot return rows, so each part is inserted on its own
+        # to learn its id; the suppliers, usually the bulk, are still batched
+        inserted = []
+        for part in parts:
+            cursor.execute(
+                "INSERT INTO parts (vin_number, client_id, part_name, part_number, quantity, notes, date_added, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING *",
+                (vin_number, client_id, part.get('name'), part.get('number'), part['quantity'], part.get('notes', ''), date_added, username, username)
+            )
+            inserted.append(_fetch_returning(cursor))
+        part_rows = pd.concat(inserted, ignore_index=True)
+        part_ids = [int(part_id) for part_id in part_rows['id']]
+        
+        supplier_params = [
+            (part_id, supplier['name'], supplier['buying_price'], supplier['selling_price'], supplier['delivery_time'], username, username)
+            for part_id, part in zip(part_ids, parts)
+            for supplier in part.get('suppliers', [])
+        ]
+        supplier_rows = None
+        if supplier_params:
+            cursor.executemany(
+                "INSERT INTO part_suppliers (part_id, supplier_name, buying_price, selling_price, delivery_time, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                supplier_params
+            )
+            # The parts were created in this transaction, so these are exactly the new suppliers
+            supplier_rows = pd.read_sql_query(
+                f"SELECT * FROM part_suppliers WHERE part_id IN ({', '.join('?' * len(part_ids))}) ORDER BY id",
+                conn, params=part_ids
+            )
+        return part_ids, part_rows, supplier_rows
+    
+    try:
+        part_ids, part_rows, supplier_rows = run_write(insert)
+    except sqlite3.Error as e:
+        print(f"Database error during bulk part addition: {e}")
+        raise
+    write_through('parts', part_rows)
+    if supplier_rows is not None:
+        write_through('part_suppliers', supplier_rows)
+    
+    if vin_number:
+        target = f"VIN: {vin_number}"
+    elif client_id is not None:
+        target = f"client: {client_id}"
+    else:
+        target = "inventory"
+    log_activity(username, "add_parts", f"Added {len(part_ids)} part(s) to {target}", 
+                "parts", None, None,
+                {"part_ids": part_ids, "parts": [{"part_name": part.get('name'), "part_number": part.get('number')} for part in parts]})
+    return part_ids
+
+def delete_client(client_id, username):
+    """
+    Delete a client and all associated data
+    
+    Returns:
+        Number of clients deleted; 0 when the client no longer exists
+    """
+    if client_id is None:
+        raise ValueError("Client ID is required")
     
-    result = _execute_query("DELETE FROM clients WHERE phone = ?", (phone,))
+    rows = _execute_query("DELETE FROM clients WHERE id = ? RETURNING *", (client_id,), fetch='returning')
+    write_through('clients', deleted_keys=[client_id])
     
-    if client_name:
-        log_activity(username, "delete_client", f"Deleted client: {phone} - {client_name[0]}", 
-                    "clients", phone, {"phone": phone, "client_name": client_name[0]}, None)
+    if not rows.empty:
+        old_client = _returned_row(rows)
+        log_activity(username, "delete_client", f"Deleted client: {old_client['phone']} - {old_client['client_name']}", 
+                    "clients", client_id, old_client, None)
     else:
-        log_activity(username, "delete_client", f"Deleted client: {phone}", "clients", phone, None, None)
+        # Still audited, so a delete racing another session leaves a trace
+        log_activity(username, "delete_client", f"Client not found for delete - ID: {client_id}", "clients", client_id, None, None)
     
-    return result
+    return len(rows)
 
 def delete_vin(vin_number, username):
-    """Delete a VIN and all associated parts"""
+    """
+    Delete a VIN and all associated parts
+    
+    Returns:
+        Number of VINs deleted; 0 when the VIN no longer exists
+    """
     if not vin_number:
         raise ValueError("VIN number is required")
     
-    result = _execute_query("DELETE FROM vins WHERE vin_number = ?", (vin_number,))
+    rows = _execute_query("DELETE FROM vins WHERE vin_number = ? RETURNING *", (vin_number,), fetch='returning')
+    write_through('vins', deleted_keys=[vin_number])
     
-    log_activity(username, "delete_vin", f"Deleted VIN: {vin_number}", "vins", vin_number, None, None)
-    return result
+    if not rows.empty:
+        log_activity(username, "delete_vin", f"Deleted VIN: {vin_number}", "vins", vin_number, _returned_row(rows), None)
+    else:
+        log_activity(username, "delete_vin", f"VIN not found for delete: {vin_number}", "vins", vin_number, None, None)
+    return len(rows)
 
 def delete_part(part_id, username):
-    """Delete a part and all associated suppliers"""
+    """
+    Delete a part and all associated suppliers
+    
+    Returns:
+        Number of parts deleted; 0 when the part no longer exists
+    """
     if not part_id:
         raise ValueError("Part ID is required")
     
-    part_info = _execute_query(
-        "SELECT part_name, part_number FROM parts WHERE id = ?", 
-        (part_id,), 
-        fetch='one'
-    )
-    
-    result = _execute_query("DELETE FROM parts WHERE id = ?", (part_id,))
+    rows = _execute_query("DELETE FROM parts WHERE id = ? RETURNING *", (part_id,), fetch='returning')
+    write_through('parts', deleted_keys=[part_id])
     
-    if part_info:
-        log_activity(username, "delete_part", f"Deleted part: {part_info[0]} ({part_info[1]}) - ID: {part_id}", 
-                    "parts", part_id, {"part_name": part_info[0], "part_number": part_info[1]}, None)
+    if not rows.empty:
+        old_part = _returned_row(rows)
+        log_activity(username, "delete_part", f"Deleted part: {old_part['part_name']} ({old_part['part_number']}) - ID: {part_id}", 
+                    "parts", part_id, old_part, None)
     else:
-        log_activity(username, "delete_part", f"Deleted part ID: {part_id}", "parts", part_id, None, None)
+        log_activity(username, "delete_part", f"Part not found for delete - ID: {part_id}", "parts", part_id, None, None)
     
-    return result
+    return len(rows)
 
-def update_client_and_vins(old_phone, new_phone, new_name, username):
-    """Update client information and all associated references using a cached connection."""
-    if not old_phone:
-        raise ValueError("Old phone number is required")
+def update_client(client_id, new_phone, new_name, username):
+    """
+    Update a client's phone number and name.
+    
+    VINs and parts refer to the client by id, so a new phone number only
+    changes the client row.
+    """
+    if client_id is None:
+        raise ValueError("Client ID is required")
     
     if not new_phone:
         raise ValueError("New phone number is required")
     
-    conn = get_db_connection()
-    if conn is None:
-        raise ConnectionError("Database connection not available")
-        
-    try:
-        # Get old values for logging
-        old_client = _execute_query("SELECT * FROM clients WHERE phone = ?", (old_phone,), fetch='one')
-        
+    def update(conn):
         cursor = conn.cursor()
-        cursor.execute("UPDATE clients SET phone = ?, client_name = ?, last_updated_by = ? WHERE phone = ?", 
-                      (new_phone, new_name, username, old_phone))
-        cursor.execute("UPDATE vins SET client_phone = ?, last_updated_by = ? WHERE client_phone = ?", 
-                      (new_phone, username, old_phone))
-        cursor.execute("UPDATE parts SET client_phone = ?, last_updated_by = ? WHERE client_phone = ?", 
-                      (new_phone, username, old_phone))
-        conn.commit()
+        # Old values for logging, read in the same transaction as the update
+        old_client = cursor.execute("SELECT phone, client_name FROM clients WHERE id = ?", (client_id,)).fetchone()
+        cursor.execute(f"UPDATE clients SET phone = ?, phone_key = ?, client_name = ?, {TOUCH_SQL}, last_updated_by = ? WHERE id = ? RETURNING *", 
+                      (new_phone, normalize_phone(new_phone) or None, new_name, username, client_id))
+        return old_client, _fetch_returning(cursor)
+    
+    try:
+        old_client, client_rows = run_write(update)
+        if old_client is None:
+            raise ValueError(f"Client {client_id} does not exist")
+        write_through('clients', client_rows)
         
+        old_phone, old_name = old_client
         log_activity(username, "update_client", f"Updated client: {old_phone} -> {new_phone}, name: {new_name}", 
-                    "clients", new_phone, {"phone": old_phone}, {"phone": new_phone, "client_name": new_name})
+                    "clients", client_id,
+                    {"phone": old_phone, "client_name": old_name},
+                    {"phone": new_phone, "client_name": new_name})
+    except sqlite3.IntegrityError as e:
+        raise _constraint_error(e, {
+            'clients.phone': f"Client with phone {new_phone} already exists",
+        }) from e
     except sqlite3.Error as e:
-        conn.rollback()
         print(f"Database error during client update: {e}")
         raise
 
+SUPPLIER_FIELDS = ('supplier_name', 'buying_price', 'selling_price', 'delivery_time')
+
+def _supplier_values(supplier):
+    """Map a supplier form dictionary onto part_suppliers columns."""
+    return {
+        'supplier_name': supplier['name'],
+        'buying_price': supplier['buying_price'],
+        'selling_price': supplier['selling_price'],
+        'delivery_time': supplier['delivery_time'],
+    }
+
 def update_part(part_id, part_name, part_number, quantity, notes, suppliers_data, username):
-    """Update part information and suppliers with a cached connection."""
+    """
+    Update part information and suppliers in one transaction.
+    
+    Suppliers carrying the 'id' of an existing row are updated in place when
+    they changed, suppliers without one are inserted, and existing suppliers
+    missing from suppliers_data are deleted.
+    """
     if not part_id:
         raise ValueError("Part ID is required")
     
     if not part_name and not part_number:
         raise ValueError("Part name or part number is required")
     
-    conn = get_db_connection()
-    if conn is None:
-        raise ConnectionError("Database connection not available")
-        
-    try:
-        # Get old values for logging
-        old_part = _execute_query("SELECT * FROM parts WHERE id = ?", (part_id,), fetch='one')
-        old_suppliers = _execute_query("SELECT * FROM part_suppliers WHERE part_id = ?", (part_id,), fetch='all')
-        
+    def update(conn):
         cursor = conn.cursor()
+        old_part = cursor.execute("SELECT * FROM parts WHERE id = ?", (part_id,)).fetchone()
+        cursor.execute(
+            f"SELECT id, {', '.join(SUPPLIER_FIELDS)} FROM part_suppliers WHERE part_id = ?", (part_id,)
+        )
+        existing = {row[0]: dict(zip(SUPPLIER_FIELDS, row[1:])) for row in cursor.fetchall()}
+        
         cursor.execute(
-            "UPDATE parts SET part_name = ?, part_number = ?, quantity = ?, notes = ?, last_updated_by = ? WHERE id = ?",
+            f"UPDATE parts SET part_name = ?, part_number = ?, quantity = ?, notes = ?, {TOUCH_SQL}, last_updated_by = ? WHERE id = ? RETURNING *",
             (part_name, part_number, quantity, notes, username, part_id)
         )
-        cursor.execute("DELETE FROM part_suppliers WHERE part_id = ?", (part_id, ))
+        part_rows = _fetch_returning(cursor)
+        
+        supplier_rows = []
+        old_suppliers, new_suppliers = [], []
+        kept_ids = set()
         for supplier in suppliers_data:
-            cursor.execute(
-                "INSERT INTO part_suppliers (part_id, supplier_name, buying_price, selling_price, delivery_time, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (part_id, supplier['name'], supplier['buying_price'], supplier['selling_price'], supplier['delivery_time'], username, username)
-            )
-        conn.commit()
+            values = _supplier_values(supplier)
+            supplier_id = supplier.get('id')
+            old = existing.get(int(supplier_id)) if supplier_id is not None else None
+            if old is None:
+                cursor.execute(
+                    "INSERT INTO part_suppliers (part_id, supplier_name, buying_price, selling_price, delivery_time, created_by, last_updated_by) VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING *",
+                    (part_id, *values.values(), username, username)
+                )
+                rows = _fetch_returning(cursor)
+                new_suppliers.append(dict(id=int(rows['id'].iloc[0]), **values))
+            else:
+                kept_ids.add(int(supplier_id))
+                # The form shows NULL as an empty string or 0.0, so those are not changes
+                if all((old[field] or None) == (values[field] or None) for field in SUPPLIER_FIELDS):
+                    continue
+                cursor.execute(
+                    f"UPDATE part_suppliers SET supplier_name = ?, buying_price = ?, selling_price = ?, delivery_time = ?, {TOUCH_SQL}, last_updated_by = ? WHERE id = ? RETURNING *",
+                    (*values.values(), username, int(supplier_id))
+                )
+                rows = _fetch_returning(cursor)
+                old_suppliers.append(dict(id=int(supplier_id), **old))
+                new_suppliers.append(dict(id=int(supplier_id), **values))
+            supplier_rows.append(rows)
+        
+        deleted_supplier_ids = [supplier_id for supplier_id in existing if supplier_id not in kept_ids]
+        if deleted_supplier_ids:
+            cursor.executemany("DELETE FROM part_suppliers WHERE id = ?", [(supplier_id,) for supplier_id in deleted_supplier_ids])
+            old_suppliers.extend(dict(id=supplier_id, **existing[supplier_id]) for supplier_id in deleted_supplier_ids)
+        return old_part, part_rows, supplier_rows, deleted_supplier_ids, old_suppliers, new_suppliers
+    
+    try:
+        old_part, part_rows, supplier_rows, deleted_supplier_ids, old_suppliers, new_suppliers = run_write(update)
+        write_through('parts', part_rows)
+        write_through('part_suppliers', pd.concat(supplier_rows, ignore_index=True) if supplier_rows else None, deleted_supplier_ids)
         
         log_activity(username, "update_part", f"Updated part: {part_name} ({part_number}) - ID: {part_id}", 
                     "parts", part_id, 
-                    {"part_name": old_part[3], "part_number": old_part[4], "quantity": old_part[5]},
-                    {"part_name": part_name, "part_number": part_number, "quantity": quantity})
+                    {"part_name": old_part[3], "part_number": old_part[4], "quantity": old_part[5], "suppliers": old_suppliers},
+                    {"part_name": part_name, "part_number": part_number, "quantity": quantity, "suppliers": new_suppliers})
         return part_id
     except sqlite3.Error as e:
-        conn.rollback()
         print(f"Database error during part update: {e}")
         raise
 
-def get_clients_by_page(page, page_size=20):
-    """Fetch clients for a specific page, ordered by last update."""
-    offset = page * page_size
-    query = f"SELECT * FROM clients ORDER BY last_updated DESC LIMIT ? OFFSET ?"
-    results = _execute_query(query, (page_size, offset), fetch='all')
-    return results
+def _encode_cursor(direction, last_updated, key_value):
+    """Pack a page boundary into an opaque cursor string."""
+    payload = json.dumps([direction, last_updated, key_value], default=int)
+    return base64.urlsafe_b64encode(payload.encode()).decode()
 
-def get_parts_by_page(page, page_size=20):
-    """Fetch parts for a specific page, ordered by last update."""
-    offset = page * page_size
-    query = f"SELECT * FROM parts ORDER BY last_updated DESC LIMIT ? OFFSET ?"
-    results = _execute_query(query, (page_size, offset), fetch='all')
-    return results
+def _decode_cursor(cursor):
+    """Unpack a cursor made by _encode_cursor into (direction, last_updated, key_value)."""
+    try:
+        direction, last_updated, key_value = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("Invalid page cursor")
+    if direction not in ('next', 'prev'):
+        raise ValueError("Invalid page cursor")
+    return direction, last_updated, key_value
+
+def _keyset_page(table, key, cursor, page_size):
+    """
+    Fetch one page of a table, most recently updated first, by keyset.
+    
+    Rows are ordered by (last_updated, key) descending and each page starts
+    right after the boundary stored in the cursor, so every page is an index
+    range scan on the matching composite index, however deep it is.
+    """
+    direction, boundary = 'next', []
+    if cursor:
+        direction, *boundary = _decode_cursor(cursor)
+    
+    if direction == 'next':
+        where = f"WHERE (last_updated, {key}) < (?, ?)" if boundary else ""
+        order = "DESC"
+    else:
+        where = f"WHERE (last_updated, {key}) > (?, ?)"
+        order = "ASC"
+    query = f"SELECT * FROM {table} {where} ORDER BY last_updated {order}, {key} {order} LIMIT ?"
+    
+    try:
+        with read_connection() as conn:
+            # One extra row tells whether there is anything beyond this page
+            rows = pd.read_sql_query(query, conn, params=boundary + [page_size + 1])
+    except sqlite3.Error as e:
+        print(f"Error fetching {table} page: {e}")
+        return pd.DataFrame(), None, None
+    
+    has_more = len(rows) > page_size
+    rows = rows.iloc[:page_size]
+    if direction == 'prev':
+        rows = rows.iloc[::-1].reset_index(drop=True)
+    if rows.empty:
+        return rows, None, None
+    
+    first = (rows['last_updated'].iloc[0], rows[key].iloc[0])
+    last = (rows['last_updated'].iloc[-1], rows[key].iloc[-1])
+    if direction == 'next':
+        next_cursor = _encode_cursor('next', *last) if has_more else None
+        prev_cursor = _encode_cursor('prev', *first) if boundary else None
+    else:
+        next_cursor = _encode_cursor('next', *last)
+        prev_cursor = _encode_cursor('prev', *first) if has_more else None
+    return rows, next_cursor, prev_cursor
+
+def get_clients_page(cursor=None, page_size=20):
+    """
+    Fetch a page of clients, most recently updated first
+    
+    Args:
+        cursor: Cursor returned with a previous page, or None for the first page
+        page_size: Clients per page
+    
+    Returns:
+        (clients, next_cursor, prev_cursor) where the cursors are None when
+        there is no page in that direction
+    """
+    return _keyset_page('clients', 'id', cursor, page_size)
+
+def get_parts_page(cursor=None, page_size=20):
+    """
+    Fetch a page of parts, most recently updated first
+    
+    Args:
+        cursor: Cursor returned with a previous page, or None for the first page
+        page_size: Parts per page
+    
+    Returns:
+        (parts, next_cursor, prev_cursor) where the cursors are None when
+        there is no page in that direction
+    """
+    return _keyset_page('parts', 'id', cursor, page_size)
+
+def _like_pattern(text):
+    """Build a LIKE pattern matching text anywhere, with wildcards in text escaped."""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+def build_parts_query(filters):
+    """
+    Translate Parts Inventory filters into a WHERE clause and its parameters
+    
+    Args:
+        filters: Dictionary with any of search, part_name, part_number,
+            client_phone, quantity_min, quantity_max and has_vin
+            ('With VIN' or 'Without VIN')
+    
+    Returns:
+        (where, params) where where is empty or starts with WHERE
+    """
+    clauses = []
+    params = []
+    
+    if filters.get('search'):
+        clauses.append("(part_name LIKE ? ESCAPE '\\' OR part_number LIKE ? ESCAPE '\\' OR notes LIKE ? ESCAPE '\\')")
+        params.extend([_like_pattern(filters['search'])] * 3)
+    if filters.get('part_name'):
+        clauses.append("part_name LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(filters['part_name']))
+    if filters.get('part_number'):
+        clauses.append("part_number LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(filters['part_number']))
+    if filters.get('client_phone'):
+        clauses.append("client_id = (SELECT id FROM clients WHERE phone_key = ?)")
+        params.append(normalize_phone(filters['client_phone']))
+    if filters.get('quantity_min') is not None:
+        clauses.append("quantity >= ?")
+        params.append(filters['quantity_min'])
+    if filters.get('quantity_max') is not None:
+        clauses.append("quantity <= ?")
+        params.append(filters['quantity_max'])
+    if filters.get('has_vin') == 'With VIN':
+        clauses.append("vin_number IS NOT NULL")
+    elif filters.get('has_vin') == 'Without VIN':
+        clauses.append("vin_number IS NULL")
+    
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+def get_parts_inventory_page(filters, page, page_size=15):
+    """
+    Fetch one filtered page of the Parts Inventory
+    
+    Filtering, counting and paging run in SQLite, and suppliers are read only
+    for the parts on the page, all on one reader connection. Each part comes
+    with its client's phone as client_phone.
+    
+    Args:
+        filters: Filter dictionary accepted by build_parts_query
+        page: Zero-based page number
+        page_size: Parts per page
+    
+    Returns:
+        (parts, suppliers, total) with the page's parts and suppliers as
+        DataFrames and total the number of parts matching the filters
+    """
+    where, params = build_parts_query(filters)
+    try:
+        with read_connection() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM parts {where}", params).fetchone()[0]
+            parts = pd.read_sql_query(
+                f"""SELECT parts.*, clients.phone AS client_phone
+                    FROM parts LEFT JOIN clients ON clients.id = parts.client_id
+                    {where} ORDER BY parts.id LIMIT ? OFFSET ?""",
+                conn, params=params + [page_size, page * page_size]
+            )
+            part_ids = parts['id'].tolist()
+            suppliers = pd.read_sql_query(
+                f"SELECT * FROM part_suppliers WHERE part_id IN ({', '.join('?' * len(part_ids))}) ORDER BY id",
+                conn, params=part_ids
+            ) if part_ids else pd.DataFrame()
+    except sqlite3.Error as e:
+        print(f"Error loading parts inventory: {e}")
+        return pd.DataFrame(), pd.DataFrame(), 0
+    return parts, suppliers, total
 
 def count_table_rows(table_name):
     """Count total rows in a table."""
@@ -381,25 +747,37 @@ def count_table_rows(table_name):
     count = _execute_query(query, fetch='one')
     return count[0] if count else 0
 
+def find_client_id(phone):
+    """Return the id of the client matching phone in any format, or None."""
+    key = normalize_phone(phone)
+    if not key:
+        return None
+    row = _execute_query("SELECT id FROM clients WHERE phone_key = ?", (key,), fetch='one')
+    return row[0] if row else None
+
 def get_client_by_phone(phone):
     """Retrieve client details by phone number."""
-    return _execute_query("SELECT * FROM clients WHERE phone = ?", (phone,), fetch='one')
+    return _execute_query("SELECT * FROM clients WHERE phone_key = ?", (normalize_phone(phone),), fetch='one')
+
+def get_client(client_id):
+    """Retrieve client details by client ID."""
+    return _execute_query("SELECT * FROM clients WHERE id = ?", (client_id,), fetch='one')
 
-def get_vins_for_client(phone):
-    """Retrieve all VINs for a given client phone number."""
-    return _execute_query("SELECT * FROM vins WHERE client_phone = ?", (phone,), fetch='all')
+def get_vins_for_client(client_id):
+    """Retrieve all VINs for a given client."""
+    return _execute_query("SELECT * FROM vins WHERE client_id = ?", (client_id,), fetch='all')
     
 def get_parts_for_vin(vin_number):
     """Retrieve all parts for a given VIN."""
     return _execute_query("SELECT * FROM parts WHERE vin_number = ?", (vin_number,), fetch='all')
 
-def get_parts_for_client_without_vin(client_phone):
+def get_parts_for_client_without_vin(client_id):
     """Retrieve parts added for a client without a VIN."""
-    return _execute_query("SELECT * FROM parts WHERE vin_number IS NULL AND client_phone = ?", (client_phone,), fetch='all')
+    return _execute_query("SELECT * FROM parts WHERE vin_number IS NULL AND client_id = ?", (client_id,), fetch='all')
 
 def get_vin_details(vin_number):
     """Retrieve VIN details."""
-    return _execute_query("SELECT * FROM vins WHERE vin_number = ?", (vin_number,), fetch='one')
+    return _execute_query("SELECT * FROM vins WHERE vin_key = ?", (normalize_vin(vin_number),), fetch='one')
 
 def get_suppliers_for_part(part_id):
     """Retrieve suppliers for a given part."""
@@ -409,19 +787,49 @@ def get_part_details(part_id):
     """Retrieve a single part details by its ID."""
     return _execute_query("SELECT * FROM parts WHERE id = ?", (part_id,), fetch='one')
 
-def get_client_info_for_export(phone):
+def load_related(table, column, keys, columns='*', chunk_size=500):
+    """
+    Fetch the rows of table whose column value is in keys, grouped by key
+    
+    Replaces one query per key with one IN (...) query per chunk_size keys,
+    all on a single reader connection.
+    
+    Args:
+        table: Table to read
+        column: Column matched against keys
+        keys: Key values to fetch rows for
+        columns: Comma separated columns to return for each row
+        chunk_size: Keys per query, kept below SQLite's parameter limit
+    
+    Returns:
+        Dictionary mapping every key to the list of its row tuples
+    """
+    keys = list(dict.fromkeys(keys))
+    grouped = {key: [] for key in keys}
+    with read_connection() as conn:
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            rows = conn.execute(
+                f"SELECT {column}, {columns} FROM {table} WHERE {column} IN ({', '.join('?' * len(chunk))}) ORDER BY rowid",
+                chunk
+            ).fetchall()
+            for row in rows:
+                grouped[row[0]].append(row[1:])
+    return grouped
+
+def get_client_info_for_export(client_id):
     """Retrieve client and associated VINs and parts for a quote or invoice."""
-    client_info = _execute_query("SELECT * FROM clients WHERE phone = ?", (phone,), fetch='one')
+    client_info = get_client(client_id)
     if not client_info:
         return None
     
-    vins = _execute_query("SELECT vin_number, model FROM vins WHERE client_phone = ?", (phone,), fetch='all')
-    parts = _execute_query("SELECT id, vin_number, part_name, part_number, quantity, notes FROM parts WHERE client_phone = ?", (phone,), fetch='all')
+    vins = _execute_query("SELECT vin_number, model FROM vins WHERE client_id = ?", (client_id,), fetch='all')
+    parts = _execute_query("SELECT id, vin_number, part_name, part_number, quantity, notes FROM parts WHERE client_id = ?", (client_id,), fetch='all')
+    suppliers = load_related('part_suppliers', 'part_id', [part[0] for part in parts])
     
     parts_with_suppliers = []
     for part in parts:
         part_id, vin, name, number, qty, notes = part
-        suppliers = get_suppliers_for_part(part_id)
         parts_with_suppliers.append({
             'id': part_id,
             'vin_number': vin,
@@ -429,7 +837,7 @@ def get_client_info_for_export(phone):
             'part_number': number,
             'quantity': qty,
             'notes': notes,
-            'suppliers': suppliers
+            'suppliers': suppliers[part_id]
         })
         
     return {
@@ -438,23 +846,73 @@ def get_client_info_for_export(phone):
         'parts': parts_with_suppliers
     }
 
-def get_quote_data(phone, selected_vin, selected_part_ids):
+def _json_rows(alias, columns):
+    """SQL aggregating the rows selected under alias into a JSON array of objects."""
+    fields = ', '.join(f"'{col}', {alias}.{col}" for col in columns)
+    return f"json_group_array(json_object({fields}))"
+
+def _load_client_bundle(client_id):
+    """Read one client's rows from all four tables with a single query."""
+    try:
+        with read_connection() as conn:
+            columns = {
+                table: [col[1] for col in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+                for table in CACHED_TABLES
+            }
+            row = conn.execute(f"""
+                SELECT
+                    (SELECT {_json_rows('c', columns['clients'])} FROM clients c WHERE c.id = :client_id),
+                    (SELECT {_json_rows('v', columns['vins'])} FROM vins v WHERE v.client_id = :client_id),
+                    (SELECT {_json_rows('p', columns['parts'])} FROM parts p WHERE p.client_id = :client_id),
+                    (SELECT {_json_rows('ps', columns['part_suppliers'])}
+                       FROM part_suppliers ps JOIN parts p ON p.id = ps.part_id WHERE p.client_id = :client_id)
+            """, {'client_id': client_id}).fetchone()
+    except sqlite3.Error as e:
+        print(f"Error loading client bundle: {e}")
+        return None
+    
+    # Same dtypes as the shared table frames, so rows compare and render alike
+    frames = [
+        _apply_dtypes(table, pd.DataFrame(json.loads(rows), columns=columns[table]))
+        for table, rows in zip(CACHED_TABLES, row)
+    ]
+    return DataIndex.from_frames(*frames)
+
+def get_client_bundle(client_id):
+    """
+    Return a DataIndex over one client, its VINs, parts and their suppliers.
+    
+    Bundles come from one query and are kept in a shared LRU cache until a
+    write touches one of the client's rows, so moving between a client's
+    views does not go back to the database. The frames are shared and must
+    not be modified.
+    """
+    bundle = get_client_bundle_cache().get(int(client_id), _load_client_bundle)
+    if bundle is None:
+        return DataIndex.from_frames(pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame())
+    return bundle
+
+QUOTE_PART_COLUMNS = ['id', 'vin_number', 'client_id', 'part_name', 'part_number', 'quantity', 'notes', 'date_added', 'created_date', 'last_updated']
+
+def get_quote_data(client_id, selected_vin, selected_part_ids):
     """Retrieve data for generating a quote."""
-    client_info = get_client_by_phone(phone)
+    client_info = get_client(client_id)
     if not client_info:
         return None
     
     vin_info = None
     if selected_vin:
         vin_info = get_vin_details(selected_vin)
-        
+    
+    part_ids = [int(part_id) for part_id in selected_part_ids]
+    parts = load_related('parts', 'id', part_ids, columns=', '.join(QUOTE_PART_COLUMNS))
+    suppliers = load_related('part_suppliers', 'part_id', part_ids)
+    
     parts_data = []
-    for part_id in selected_part_ids:
-        part_details = get_part_details(part_id)
-        if part_details:
-            suppliers = get_suppliers_for_part(part_id)
-            part_dict = dict(zip(['id', 'vin_number', 'client_phone', 'part_name', 'part_number', 'quantity', 'notes', 'date_added', 'created_date', 'last_updated'], part_details))
-            part_dict['suppliers'] = suppliers
+    for part_id in part_ids:
+        if parts[part_id]:
+            part_dict = dict(zip(QUOTE_PART_COLUMNS, parts[part_id][0]))
+            part_dict['suppliers'] = suppliers[part_id]
             parts_data.append(part_dict)
             
     return {
@@ -463,37 +921,92 @@ def get_quote_data(phone, selected_vin, selected_part_ids):
         'parts': parts_data
     }
 
-def search_db(query):
-    """Perform a comprehensive search across all relevant tables safely."""
-    if not query:
-        return {'clients': pd.DataFrame(), 'vins': pd.DataFrame(), 'parts': pd.DataFrame()}
-    
-    conn = get_db_connection()
-    if conn is None:
-        return {'clients': pd.DataFrame(), 'vins': pd.DataFrame(), 'parts': pd.DataFrame()}
+# Markers placed around the matched terms in search snippets
+SNIPPET_MARKERS = ('[', ']')
+
+def _client_phone_join(table):
+    """Select list addition and join giving rows of table (aliased t) their client's phone."""
+    if table == 'clients':
+        return "", ""
+    return ", c.phone AS client_phone", "LEFT JOIN clients c ON c.id = t.client_id"
+
+def _fts_query(text):
+    """Turn user input into an FTS5 query that matches every word as a prefix."""
+    words = [word for word in re.split(r'\W+', text) if word]
+    return ' '.join(f'"{word}"*' for word in words)
 
-    # Use parameterized queries to prevent SQL injection
-    search_pattern = f"%{query}%"
+def search_db(query, limit=50):
+    """
+    Search clients, VINs and parts through the full-text index.
+    
+    Every word of query has to match the start of a word in one of the
+    indexed columns. Each table returns at most limit rows, best match first,
+    with a 'snippet' column showing the match between SNIPPET_MARKERS. VIN
+    and part rows also carry their client's phone as client_phone.
+    """
+    empty = {table: pd.DataFrame() for table in SEARCH_COLUMNS}
+    fts_query = _fts_query(query) if query else ''
+    if not fts_query:
+        return empty
     
+    results = {}
     try:
-        df_clients = pd.read_sql_query(
-            "SELECT * FROM clients WHERE phone LIKE ? OR client_name LIKE ?", 
-            conn, params=[search_pattern, search_pattern]
-        )
-        df_vins = pd.read_sql_query(
-            "SELECT * FROM vins WHERE vin_number LIKE ? OR model LIKE ?", 
-            conn, params=[search_pattern, search_pattern]
-        )
-        df_parts = pd.read_sql_query(
-            "SELECT * FROM parts WHERE part_name LIKE ? OR part_number LIKE ? OR notes LIKE ?", 
-            conn, params=[search_pattern, search_pattern, search_pattern]
-        )
+        with read_connection() as conn:
+            for table in SEARCH_COLUMNS:
+                client_phone, client_join = _client_phone_join(table)
+                results[table] = pd.read_sql_query(
+                    f"""SELECT t.*{client_phone}, snippet({table}_fts, -1, ?, ?, '...', 8) AS snippet
+                        FROM {table}_fts JOIN {table} t ON t.rowid = {table}_fts.rowid {client_join}
+                        WHERE {table}_fts MATCH ?
+                        ORDER BY rank LIMIT ?""",
+                    conn, params=[*SNIPPET_MARKERS, fts_query, limit]
+                )
     except Exception as e:
         print(f"Error during search: {e}")
-        return {'clients': pd.DataFrame(), 'vins': pd.DataFrame(), 'parts': pd.DataFrame()}
+        return empty
     
-    return {
-        'clients': df_clients,
-        'vins': df_vins,
-        'parts': df_parts
-    }
\ No newline at end of file
+    return results
+
+def fragment_search(fragment, limit=20):
+    """
+    Find clients, VINs and parts whose phone, VIN or part number contains fragment.
+    
+    Meant for partial input such as the last digits of a phone number or part
+    of a VIN. Lookups go through the trigram indexes, so fragment needs at
+    least three characters; matching ignores case. Phones are matched on
+    their digits, so separators in either the fragment or the stored number
+    do not matter.
+    
+    Returns a dictionary of DataFrames keyed by table, at most limit rows each,
+    with the client's phone on VIN and part rows as client_phone.
+    """
+    fragment = (fragment or '').strip()
+    empty = {table: pd.DataFrame() for table in FRAGMENT_COLUMNS}
+    if len(fragment) < 3:
+        return empty
+    
+    results = {}
+    try:
+        with read_connection() as conn:
+            for table, column in FRAGMENT_COLUMNS.items():
+                text = fragment
+                key_column, _, normalize = LOOKUP_KEYS.get(table, (None, None, None))
+                if column == key_column:
+                    # Normalized key columns are searched with the fragment normalized the same way
+                    text = normalize(fragment)
+                    if len(text) < 3:
+                        results[table] = pd.DataFrame()
+                        continue
+                # A quoted string matches as a substring under the trigram tokenizer
+                match = '"' + text.replace('"', '""') + '"'
+                client_phone, client_join = _client_phone_join(table)
+                results[table] = pd.read_sql_query(
+                    f"""SELECT t.*{client_phone} FROM {table}_trigram JOIN {table} t ON t.rowid = {table}_trigram.rowid {client_join}
+                        WHERE {table}_trigram MATCH ? LIMIT ?""",
+                    conn, params=[match, limit]
+                )
+    except Exception as e:
+        print(f"Error during fragment search: {e}")
+        return empty
+    
+    return results
@@ -47,6 +47,13 @@ def normalize_vin(vin: str | None) -> str:
     return re.sub(r"\s+", "", vin).upper()
 
 
+def normalize_phone(phone: str | None) -> str:
+    """Reduce a phone number to its digits so differently formatted entries compare equal."""
+    if not phone:
+        return ""
+    return re.sub(r"\D", "", str(phone))
+
+
 def validate_numeric(value, min_val=None, max_val=None):
     """Validate numeric values"""
     try:
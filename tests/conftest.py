@@ -0,0 +1,42 @@
+# conftest.py
+import functools
+import os
+import sys
+
+import pytest
+import streamlit as st
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _cache_resource(func):
+    """Per-process cache standing in for st.cache_resource, which does not cache outside a running app."""
+    cached = functools.cache(func)
+    cached.clear = cached.cache_clear
+    return cached
+
+st.cache_resource = _cache_resource
+
+import db_utils
+import auth
+
+# Process-wide resources that hold connections to, or data from, one database
+SHARED_RESOURCES = (
+    db_utils.get_connection_manager,
+    db_utils.get_snapshot_store,
+    db_utils.get_cache_registry,
+    db_utils.get_client_bundle_cache,
+    db_utils.get_change_monitor,
+)
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """Point the data layer at an empty, fully migrated database."""
+    monkeypatch.setattr(db_utils, 'DB_NAME', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(db_utils, '_schema_version', None)
+    for resource in SHARED_RESOURCES:
+        resource.clear()
+    db_utils.run_migrations()
+    yield tmp_path / 'test.db'
+    auth.flush_activity_log()
+    for resource in SHARED_RESOURCES:
+        resource.clear()
@@ -0,0 +1,34 @@
+# test_deletes.py
+import sqlite3
+
+import auth
+import db_utils
+import logic
+
+
+def test_delete_client_with_vehicle_without_vin(fresh_db):
+    client_id = logic.add_new_client('5551234567', 'Test Client', 'admin')
+    logic.add_vin_to_client(client_id, None, 'E46', '2003', '', '', '', '', 'admin')
+    logic.add_vin_to_client(client_id, '1HGCM82633A004352', 'E90', '2008', '', '', '', '', 'admin')
+    
+    logic.delete_client(client_id, 'admin')
+    
+    conn = sqlite3.connect(fresh_db)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM vins").fetchone()[0] == 0
+        tombstones = conn.execute("SELECT table_name, row_key FROM deleted_rows ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    assert ('vins', '1HGCM82633A004352') in tombstones
+    assert ('clients', str(client_id)) in tombstones
+
+
+def test_delete_of_missing_rows_is_reported_and_audited(fresh_db):
+    assert logic.delete_client(12345, 'admin') == 0
+    assert logic.delete_vin('1HGCM82633A004352', 'admin') == 0
+    assert logic.delete_part(678, 'admin') == 0
+    
+    auth.flush_activity_log()
+    logs = db_utils.get_activity_logs(username='admin')
+    assert sorted(logs['action'].tolist()) == ['delete_client', 'delete_part', 'delete_vin']
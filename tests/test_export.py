@@ -0,0 +1,19 @@
+# test_export.py
+import io
+import zipfile
+
+import pandas as pd
+
+import db_utils
+import logic
+
+
+def test_export_client_filter_ignores_phone_formatting(fresh_db):
+    client_id = logic.add_new_client('555-123-4567', 'Test Client', 'admin')
+    logic.add_new_client('5559876543', 'Other Client', 'admin')
+    
+    output, _ = db_utils.export_filtered_data({'client_phone': '(555) 123 4567', 'include': ['clients']})
+    
+    with zipfile.ZipFile(output) as archive:
+        clients = pd.read_csv(io.BytesIO(archive.read('clients.csv')))
+    assert clients['id'].tolist() == [client_id]
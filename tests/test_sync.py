@@ -0,0 +1,54 @@
+# test_sync.py
+import sqlite3
+
+import db_utils
+import logic
+
+
+def test_vehicles_without_vin_do_not_break_the_vins_snapshot(fresh_db, capsys):
+    client_id = logic.add_new_client('5551234567', 'Test Client', 'admin')
+    logic.add_vin_to_client(client_id, '1HGCM82633A004352', 'E90', '2008', '', '', '', '', 'admin')
+    db_utils.sync_changes()
+    db_utils.load_table('vins')
+    
+    # Written through the app, then by another process the app only sees through sync
+    logic.add_vin_to_client(client_id, None, 'E46', '2003', '', '', '', '', 'admin')
+    conn = sqlite3.connect(fresh_db)
+    try:
+        with conn:
+            conn.execute("INSERT INTO vins (vin_number, client_id, model) VALUES (NULL, ?, 'E36')", (client_id,))
+            conn.execute("UPDATE vins SET model = 'E91' WHERE vin_number = '1HGCM82633A004352'")
+    finally:
+        conn.close()
+    assert db_utils.sync_changes() == ['vins']
+    assert db_utils.sync_changes() == []
+    
+    vins = db_utils.load_table('vins')
+    assert vins['vin_number'].tolist() == ['1HGCM82633A004352']
+    assert vins['model'].tolist() == ['E91']
+    assert 'Error' not in capsys.readouterr().out
+
+
+def test_snapshot_reads_each_change_once_and_only_after_applying_it(fresh_db, monkeypatch):
+    first = logic.add_new_client('5551234567', 'First Client', 'admin')
+    snapshot = db_utils.TableSnapshot('clients')
+    with db_utils.read_connection() as conn:
+        snapshot.full_load(conn)
+    
+    second = logic.add_new_client('5559876543', 'Second Client', 'admin')
+    
+    def broken_patch(*args):
+        raise RuntimeError('patch failed')
+    
+    with db_utils.read_connection() as conn:
+        with monkeypatch.context() as m:
+            m.setattr(db_utils, '_patch_rows', broken_patch)
+            try:
+                snapshot.apply_changes(conn)
+            except RuntimeError:
+                pass
+        changed, deleted_keys = snapshot.apply_changes(conn)
+        assert changed['id'].tolist() == [second]
+        changed, deleted_keys = snapshot.apply_changes(conn)
+        assert changed.empty and deleted_keys == []
+    assert sorted(snapshot.frame['id'].tolist()) == [first, second]